@@ -53,6 +53,17 @@ COMPUTE_EXCEPTIONS = {
     },
 }
 
+# Stored precision of parameters in new stores, keyed by netcdf name, data
+# product identifier or name pattern. "dtype" downcasts the stored array and
+# "keepbits" keeps that many mantissa bits of floats (numcodecs BitRound)
+PRECISION_POLICY = {
+    "*_qartod_results": {"dtype": "int8"},
+    "*_qartod_executed": {"dtype": "int8"},
+    "*_qc_executed": {"dtype": "uint8"},
+    "*_qc_results": {"dtype": "uint8"},
+    # e.g. "sea_water_temperature": {"dtype": "float32", "keepbits": 12},
+}
+
 # consolidated instrument config with stage column in rca-data-tools repo
 UNIFIED_CONFIG_DF = pd.read_csv(
     "https://raw.githubusercontent.com/OOI-CabledArray/rca-data-tools/main/rca_data_tools/qaqc/params/sitesDictionary.csv"  # noqa
@@ -22,5 +22,13 @@ class DimensionChangedError(Exception):
     pass
 
 
+class DtypeOverflowError(Exception):
+    pass
+
+
 class RefreshRequestInAppendModeError(Exception):
     pass
+
+
+class IncompleteRefreshError(Exception):
+    pass
@@ -23,6 +23,7 @@ from data_vent.tasks import (
     setup_process,
     data_processing,
     finalize_data_stream,
+    update_analysis_replica,
     read_status_json,
     run_advanced_qaqc,
 )
@@ -126,12 +127,15 @@ def stream_ingest(
     )
 
     # Finalize data and transfer to final
-    finalize_data_stream(
+    final_path = finalize_data_stream(
         stores_dict,
         stream_harvest,
         max_chunk,
     )
 
+    if stream_harvest.harvest_options.processing.analysis_replica:
+        update_analysis_replica(final_path, stream_harvest)
+
     if stream_harvest.table_name in harvest_calc_dict:
         run_advanced_qaqc(
             stream_harvest,
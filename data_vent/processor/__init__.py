@@ -9,31 +9,70 @@ import dask
 import xarray as xr
 from xarray import coding
 
+from numcodecs import Blosc, Delta
 from rechunker.algorithm import prod
-from rechunker import rechunk  # noqa
 
 from rca_data_tools.qaqc.constants import MAX_COORD_SIZES
 from data_vent.exceptions import DimensionChangedError
+from data_vent.utils.time_index import read_time_index
 
 from .utils import (
     _prepare_existing_zarr,
     _prepare_ds_to_append,
     _validate_dims,
-    _download
+    _trim_overlap,
+    _check_stored_dtypes,
+    _download,
+    _commit_zarr,
+    _copy_zarr_store,
+    _clear_store,
 )
-
-
-def _update_time_coverage(store: fsspec.mapping.FSMap) -> None:
-    """Updates start and end date in global attributes"""
+from .state import ZarrStoreState
+from .codecs import tune_codecs, _sample, _encode
+from .precision import apply_precision_policy
+
+
+def _update_time_coverage(
+    store: fsspec.mapping.FSMap,
+    changed_keys=None,
+    tail_store=None,
+    time_index=None,
+    generation=None,
+) -> None:
+    """
+    Updates start and end date in global attributes. Pass the metadata
+    keys written since the last commit as ``changed_keys`` to patch them
+    into the published metadata instead of re-consolidating the store.
+    The end date comes from ``tail_store`` when the store has one.
+    Dates are taken from the time index, ``time_index`` or the published
+    one, and only read from the time array without it. ``generation`` is
+    passed on to ``_commit_zarr``.
+    """
     zg = zarr.open_group(store, mode="r+")
     calendar = zg.time.attrs.get("calendar", "gregorian")
     units = zg.time.attrs.get("units", "seconds since 1900-01-01 0:0:0")
+    if time_index is None and changed_keys is not None:
+        time_index = read_time_index(store)
+    if time_index is not None:
+        first_time, last_time = time_index["start"], time_index["end"]
+    else:
+        first_time, last_time = zg.time[0], zg.time[-1]
+    if tail_store is not None and is_zarr_ready(tail_store):
+        tail_index = read_time_index(tail_store)
+        if tail_index is not None:
+            last_time = tail_index["end"]
+        else:
+            last_time = zarr.open_consolidated(tail_store).time[-1]
     start, end = xr.coding.times.decode_cf_datetime(
-        [zg.time[0], zg.time[-1]], units=units, calendar=calendar
+        [first_time, last_time], units=units, calendar=calendar
     )
     zg.attrs["time_coverage_start"] = str(start)
     zg.attrs["time_coverage_end"] = str(end)
-    zarr.consolidate_metadata(store)
+    if changed_keys is not None:
+        changed_keys = [*changed_keys, ".zattrs"]
+    _commit_zarr(
+        store, changed_keys=changed_keys, time_index=time_index, generation=generation
+    )
     return str(start), str(end)
 
 
@@ -196,43 +235,100 @@ def _meta_cleanup(chunked_ds):
     return chunked_ds
 
 
-def append_to_zarr(mod_ds, store, encoding, overwrite_attrs, logger=None):
+def _write_scheduler(write_concurrency=1):
+    """
+    Dask config for zarr writes: the single-threaded scheduler by default,
+    or a thread pool issuing up to ``write_concurrency`` chunk PUTs at once.
+    """
+    if write_concurrency > 1:
+        return dask.config.set(scheduler="threads", num_workers=write_concurrency)
+    return dask.config.set(scheduler="single-threaded")
+
+
+def _align_to_zarr_chunks(mod_ds, state, append_dim="time"):
+    """
+    Chunk the dataset to append so every dask chunk maps onto exactly one
+    zarr chunk of the existing store, starting with the space left in the
+    partially filled last chunk. Needed for concurrent writes since
+    safe_chunks is disabled on append.
+    """
+    for var_name, var in mod_ds.variables.items():
+        if append_dim not in var.dims or var_name not in state:
+            continue
+        var_chunks = {}
+        for axis, dim in enumerate(var.dims):
+            zchunk = state.chunks[var_name][axis]
+            size = var.sizes[dim]
+            if dim == append_dim:
+                offset = state.shapes[var_name][axis] % zchunk
+                first = min(zchunk - offset, size)
+                chunks = [first] if first else []
+                remaining = size - first
+                chunks += [zchunk] * (remaining // zchunk)
+                if remaining % zchunk:
+                    chunks.append(remaining % zchunk)
+                var_chunks[dim] = tuple(chunks) or (0,)
+            else:
+                var_chunks[dim] = zchunk
+        mod_ds[var_name] = var.chunk(var_chunks)
+    return mod_ds
+
+
+def append_to_zarr(
+    mod_ds,
+    store,
+    encoding,
+    overwrite_attrs,
+    logger=None,
+    write_concurrency=1,
+    state=None,
+    commit=True,
+):
+    """
+    Append ``mod_ds`` along time to the zarr ``store`` and commit it.
+    Pass the same ``ZarrStoreState`` for every append to a store within
+    a run to avoid re-reading its schema from S3 each time. With
+    ``commit=False`` the append stays unpublished until ``state.commit()``.
+    """
     if logger is None:
         logger = get_logger()
-    existing_zarr = zarr.open_group(store, mode="a")
+    if state is None:
+        state = ZarrStoreState(store)
 
     if overwrite_attrs:
         logger.info("Overwriting existing zarr global and variable attributes.")
-        existing_zarr.attrs.update(mod_ds.attrs)
+        state.group.attrs.update(mod_ds.attrs)
 
         # overwrite each variable’s attributes
         for var_name in mod_ds.data_vars:
             if var_name in mod_ds:
-                existing_zarr[var_name].attrs.update(mod_ds[var_name].attrs)
+                state.group[var_name].attrs.update(mod_ds[var_name].attrs)
+                state.mark(f"{var_name}/.zattrs")
+        state.mark(".zattrs")
 
-        # rebuild consolidated metadata
-        zarr.convenience.consolidate_metadata(existing_zarr.store)
-
-    existing_var_count = len(list(existing_zarr.array_keys()))
+    existing_var_count = len(state.shapes)
     to_append_var_count = len(mod_ds.variables)
 
     if existing_var_count < to_append_var_count:
-        existing_zarr = _prepare_existing_zarr(store, mod_ds, enc=encoding)
+        _prepare_existing_zarr(store, mod_ds, enc=encoding, state=state)
     else:
-        mod_ds = _prepare_ds_to_append(store, mod_ds)
+        mod_ds = _prepare_ds_to_append(store, mod_ds, state=state)
 
     dim_indexer, modify_zarr_dims, issue_dims = _validate_dims(
-        mod_ds, existing_zarr, append_dim="time"
+        mod_ds, state, append_dim="time"
     )
 
     if len(issue_dims) > 0:
         logger.warning(
             f"{','.join(issue_dims)} dimension(s) are problematic. Skipping append..."
         )
+        # still publish attribute and new variable changes
+        if commit:
+            state.commit()
         return False
 
     if modify_zarr_dims:
-        changed = {d: (existing_zarr[d].shape[0], len(v)) for d, v in dim_indexer.items()}
+        changed = {d: (state.shapes[d][0], len(v)) for d, v in dim_indexer.items()}
         raise DimensionChangedError(
             f"Non-time dimension size increased: {changed}. "
             "Run with refresh=True to rewrite the store at the new dimension size."
@@ -241,34 +337,104 @@ def append_to_zarr(mod_ds, store, encoding, overwrite_attrs, logger=None):
         logger.info("Reindexing dataset to append ...")
         mod_ds = mod_ds.reindex(dim_indexer)
 
-    # Remove append_dim duplicates by checking for existing tail
+    # Remove samples already in the store, only its tail chunk is read
     append_dim = "time"
-    if existing_zarr[append_dim][-1] == mod_ds[append_dim].data[0]:
-        mod_ds = mod_ds.drop_isel({append_dim: 0})
+    mod_ds, trimmed = _trim_overlap(mod_ds, state.tail(), append_dim=append_dim)
+    if trimmed:
+        logger.info(f"Trimmed {trimmed} sample(s) overlapping the existing store.")
 
     if mod_ds[append_dim].size == 0:
         logger.warning("Nothing to append.")
     else:
+        _check_stored_dtypes(mod_ds, state)
         logger.info("Appending zarr file.")
-        mod_ds.to_zarr(
-            store,
-            consolidated=True,
-            compute=True,
-            mode="a",
-            append_dim=append_dim,
-            safe_chunks=False,
-        )
-
+        if write_concurrency > 1:
+            mod_ds = _align_to_zarr_chunks(mod_ds, state, append_dim=append_dim)
+        with _write_scheduler(write_concurrency):
+            mod_ds.to_zarr(
+                store,
+                consolidated=False,
+                compute=True,
+                mode="a",
+                append_dim=append_dim,
+                safe_chunks=False,
+                # chunks holding only fill values, e.g. from variables
+                # missing in the incoming file, are not stored
+                write_empty_chunks=False,
+            )
+        state.appended(mod_ds)
+
+    # Nothing above is visible to readers of the consolidated metadata
+    # until this single write
+    if commit:
+        generation = state.commit()
+        logger.info(f"Committed zarr generation {generation}.")
     return True
 
 
+def _merge_zarr_stores(
+    source_zarrs,
+    target_zarr,
+    storage_options,
+    max_chunk="100MB",
+    overwrite_attrs=False,
+    write_concurrency=1,
+    batch_size=32,
+    logger=None,
+):
+    """
+    Stitch zarr stores that each hold a contiguous time span into
+    ``target_zarr``, in the order given. Anything in the target is removed
+    first. The first store with data is copied as is, the others go
+    through ``append_to_zarr`` so differences in variables and non-time
+    dimensions get reconciled like any other append. Source stores are
+    removed once merged.
+    """
+    if logger is None:
+        logger = get_logger()
+    target_store = fsspec.get_mapper(target_zarr, **storage_options)
+    _clear_store(target_store)
+    target_state = None
+    for source_zarr in source_zarrs:
+        source_store = fsspec.get_mapper(source_zarr, **storage_options)
+        if not is_zarr_ready(source_store):
+            logger.warning(f"Nothing was written to {source_zarr}. Skipping merge...")
+            continue
+        logger.info(f"Merging {source_zarr} into {target_zarr}")
+        if target_state is None:
+            # metadata is published once every chunk is in place
+            _copy_zarr_store(
+                source_store,
+                target_store,
+                excludes=[r"^\.zmetadata$"],
+                batch_size=batch_size,
+            )
+            _commit_zarr(target_store, time_index=read_time_index(source_store))
+            target_state = ZarrStoreState(target_store)
+        else:
+            ds = xr.open_zarr(source_store, consolidated=True, decode_times=False)
+            mod_ds, enc = chunk_ds(ds, max_chunk=max_chunk, apply=False)
+            succeed = append_to_zarr(
+                mod_ds,
+                target_store,
+                enc,
+                overwrite_attrs,
+                logger=logger,
+                write_concurrency=write_concurrency,
+                state=target_state,
+            )
+            if not succeed:
+                logger.warning(f"SKIPPED: Issues found merging {source_zarr}!")
+        _clear_store(source_store)
+
+
 def _tens_counts(num: int, places: int = 2) -> int:
     return (math.floor(math.log10(abs(num))) + 1) - places
 
 
 def _round_down(to_round: int) -> int:
-    """Rounds down integers to whole zeros"""
-    digit_round = 10 ** _tens_counts(to_round)
+    """Rounds down integers to whole zeros, those below 100 are left as they are"""
+    digit_round = 10 ** max(_tens_counts(to_round), 0)
     return to_round - to_round % digit_round
 
 
@@ -285,12 +451,68 @@ def _calc_chunks(variable: xr.DataArray, max_chunk="100MB"):
     return chunks
 
 
+def _stored_itemsize(variable: xr.DataArray, enc: dict, sample_bytes="8MB") -> float:
+    """
+    Stored bytes per element of ``variable``, measured by encoding its
+    leading time steps up to ``sample_bytes`` with the dtype, filters and
+    compressor of ``enc``.
+    """
+    sample = _sample(variable, sample_bytes=sample_bytes)
+    if sample.size == 0:
+        return variable.dtype.itemsize
+    compressor = enc.get("compressor", zarr.storage.default_compressor)
+    sample = sample.astype(enc.get("dtype", sample.dtype))
+    return max(len(_encode(sample, compressor, enc.get("filters"))), 1) / sample.size
+
+
+def _plan_time_chunks(chunked_ds, raw_enc, target_chunk, max_chunk, time_max_chunks):
+    """
+    Time chunk length of every time variable in ``raw_enc`` so each chunk
+    compresses to about ``target_chunk`` bytes, from the compression of a
+    sample of ``chunked_ds``. The uncompressed ``max_chunk`` (and
+    ``time_max_chunks`` for time) still bounds the chunk held in memory.
+
+    Chunk lengths are snapped to the smallest one times a power of two, so
+    the chunk boundaries of every variable line up with those of the
+    variables with smaller chunks and time slices read the same grid.
+    """
+    target_bytes = dask.utils.parse_bytes(target_chunk)
+    lengths = {}
+    for k, enc in raw_enc.items():
+        v = chunked_ds[k]
+        if "time" not in v.dims:
+            continue
+        step = prod(s for d, s in zip(v.dims, v.shape) if d != "time")
+        stored = step * _stored_itemsize(v, enc)
+        cap = dask.utils.parse_bytes(time_max_chunks if k == "time" else max_chunk)
+        lengths[k] = max(min(target_bytes / stored, cap / (step * v.dtype.itemsize)), 1)
+    if not lengths:
+        return raw_enc
+
+    base = max(_round_down(math.floor(min(lengths.values()))), 1)
+    for k, length in lengths.items():
+        v = chunked_ds[k]
+        time_chunk = base * 2 ** math.floor(math.log2(length / base))
+        raw_enc[k]["chunks"] = tuple(
+            time_chunk if d == "time" else c for d, c in zip(v.dims, raw_enc[k]["chunks"])
+        )
+    return raw_enc
+
+
+# delta encoded integer time steps are near constant and compress to almost nothing
+TIME_COMPRESSOR = zarr.Blosc(cname="zstd", clevel=5, shuffle=Blosc.SHUFFLE)
+
+
 def chunk_ds(
     chunked_ds,
     max_chunk="100MB",
     time_max_chunks="100MB",
     existing_enc=None,
     apply=True,
+    target_chunk=None,
+    codec_bandwidth=None,
+    precision_policy=None,
+    verify_precision=False,
 ):
     compress = zarr.Blosc(cname="zstd", clevel=3, shuffle=2)
 
@@ -308,6 +530,25 @@ def chunk_ds(
         if "time" in chunked_ds:
             chunks = _calc_chunks(chunked_ds["time"], max_chunk=time_max_chunks)
             raw_enc["time"] = {"chunks": chunks}
+            time_dtype = chunked_ds["time"].dtype
+            if np.issubdtype(time_dtype, np.integer):
+                raw_enc["time"].update(
+                    compressor=TIME_COMPRESSOR, filters=[Delta(dtype=time_dtype)]
+                )
+
+        if precision_policy:
+            apply_precision_policy(
+                chunked_ds, raw_enc, precision_policy, verify=verify_precision
+            )
+
+        if codec_bandwidth is not None:
+            # before planning chunks, their stored size depends on the codecs
+            raw_enc = tune_codecs(chunked_ds, raw_enc, bandwidth=codec_bandwidth)
+
+        if target_chunk is not None:
+            raw_enc = _plan_time_chunks(
+                chunked_ds, raw_enc, target_chunk, max_chunk, time_max_chunks
+            )
     elif isinstance(existing_enc, dict):
         raw_enc = existing_enc
     else:
@@ -324,3 +565,18 @@ def chunk_ds(
             chunked_ds[k] = chunked_ds[k].chunk(chunks=var_chunks)
 
     return chunked_ds, raw_enc
+
+
+def _time_window(ds, enc, n_chunks=1):
+    """
+    Number of time samples covering ``n_chunks`` target chunks of the
+    variable with the smallest time chunk in ``enc``, so every variable
+    is held in memory for at most ``n_chunks`` of its chunks at once.
+    """
+    time_chunks = []
+    for k, v in enc.items():
+        if k in ds.variables and "time" in ds[k].dims and v.get("chunks"):
+            time_chunks.append(v["chunks"][ds[k].dims.index("time")])
+    if not time_chunks:
+        return ds.sizes["time"]
+    return n_chunks * min(time_chunks)
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import datetime
+import hashlib
+import threading
+from typing import Optional
+
+import fsspec
+from dask.utils import parse_bytes, memory_repr
+from loguru import logger
+
+from .utils import _download, _download_to_memory
+
+
+def _modified(info: dict) -> float:
+    """Modification time of a listed file, local or S3"""
+    modified = info.get("mtime", info.get("LastModified", 0))
+    if isinstance(modified, datetime.datetime):
+        return modified.timestamp()
+    return float(modified)
+
+
+class NetcdfCache:
+    """
+    Persistent cache of downloaded netcdf files, shared across task retries.
+
+    Files are keyed by their thredds catalog name, ``size_bytes`` and
+    ``date_modified`` so a re-generated file with the same name is never
+    served stale. The cache can live on local disk or on S3, e.g. under
+    ``config.HARVEST_CACHE_BUCKET``. An ``index.json`` next to the files
+    tracks sizes and last access times, and the least recently used files
+    are evicted once the total size goes over ``max_bytes``.
+    Files fetched during the current run are never evicted.
+
+    Several workers may share a cache, each writing the whole index. The
+    index is read again and merged with the cached files, listed afresh,
+    before every write, so entries lost to a concurrent write are rebuilt
+    from the file modification times and their files are still evicted.
+    """
+
+    def __init__(
+        self, location: str, max_bytes: str = "50GB", storage_options: Optional[dict] = None
+    ):
+        self.location = location.rstrip("/")
+        self.storage_options = storage_options or {}
+        self.fs = fsspec.get_mapper(self.location, **self.storage_options).fs
+        self.is_local = fsspec.utils.get_protocol(self.location) in ("file", "local")
+        if self.is_local:
+            self.fs.makedirs(self.location, exist_ok=True)
+        self.max_bytes = parse_bytes(max_bytes)
+        self.index_url = f"{self.location}/index.json"
+        self._lock = threading.Lock()
+        self._pinned = set()
+        self._index = self._read_index()
+
+    @staticmethod
+    def cache_key(dataset: dict) -> str:
+        token = "|".join(
+            [
+                str(dataset.get("name")),
+                str(dataset.get("size_bytes")),
+                str(dataset.get("date_modified")),
+            ]
+        )
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def _cache_url(self, key: str) -> str:
+        return f"{self.location}/{key}.nc"
+
+    def _read_index(self) -> dict:
+        if self.fs.exists(self.index_url):
+            with self.fs.open(self.index_url, mode="r") as f:
+                return json.load(f)
+        return {}
+
+    def _write_index(self):
+        with self.fs.open(self.index_url, mode="w") as f:
+            json.dump(self._index, f)
+
+    def _cached_files(self) -> dict:
+        """Listing details of the cached files, by cache key"""
+        self.fs.invalidate_cache(self.location)
+        files = {}
+        for info in self.fs.ls(self.location, detail=True):
+            name = os.path.basename(info["name"].rstrip("/"))
+            if info["type"] == "file" and name.endswith(".nc"):
+                files[name[: -len(".nc")]] = info
+        return files
+
+    def _merged_index(self) -> dict:
+        """
+        Index of the files in the cache, the latest access of each file
+        from this index and the one other workers last wrote. Files in
+        neither are entered with their modification time.
+        """
+        written = self._read_index()
+        merged = {}
+        for key, info in self._cached_files().items():
+            entries = [e for e in (written.get(key), self._index.get(key)) if e is not None]
+            if entries:
+                merged[key] = max(entries, key=lambda e: e["last_access"])
+            else:
+                merged[key] = {
+                    "name": f"{key}.nc",
+                    "size": info["size"],
+                    "last_access": _modified(info),
+                }
+        return merged
+
+    def _record(self, key: str, dataset: dict, size: int):
+        with self._lock:
+            self._index[key] = {
+                "name": dataset.get("name"),
+                "size": size,
+                "last_access": time.time(),
+            }
+            self._index = self._merged_index()
+            self._evict()
+            self._write_index()
+
+    def _evict(self):
+        total = sum(v["size"] for v in self._index.values())
+        lru_keys = sorted(self._index, key=lambda k: self._index[k]["last_access"])
+        for key in lru_keys:
+            if total <= self.max_bytes:
+                break
+            if key in self._pinned:
+                continue
+            logger.info(f"Evicting {self._index[key]['name']} from netcdf cache.")
+            try:
+                self.fs.rm(self._cache_url(key))
+            except FileNotFoundError:
+                pass
+            total -= self._index.pop(key)["size"]
+        if total > self.max_bytes:
+            logger.warning(
+                f"Netcdf cache holds {memory_repr(total)} of files used by this run, "
+                f"over its {memory_repr(self.max_bytes)} limit."
+            )
+
+    def fetch(
+        self,
+        dataset: dict,
+        source_url: str,
+        download_location: str,
+        block_size="8MB",
+        in_memory: bool = False,
+    ):
+        """
+        Get a local path to the netcdf file of ``dataset``, downloading it
+        from ``source_url`` only when it is not cached yet.
+
+        Local caches hand back the cached file itself. S3 caches copy the
+        cached object into ``download_location``, or return its bytes when
+        ``in_memory`` is set.
+        """
+        key = self.cache_key(dataset)
+        cache_url = self._cache_url(key)
+        with self._lock:
+            # pin before looking so a concurrent fetch can't evict it under us
+            self._pinned.add(key)
+
+        if self.fs.exists(cache_url):
+            logger.info(f"Netcdf cache hit: {dataset.get('name')}")
+            self._record(key, dataset, self.fs.size(cache_url))
+            if self.is_local:
+                return cache_url
+            if in_memory:
+                return self.fs.cat_file(cache_url)
+            return _download(
+                cache_url,
+                download_location,
+                block_size=block_size,
+                target_name=dataset.get("name"),
+                storage_options=self.storage_options,
+            )
+
+        if self.is_local:
+            ncpath = _download(
+                source_url, self.location, block_size=block_size, target_name=f"{key}.nc"
+            )
+        elif in_memory:
+            data = _download_to_memory(source_url, block_size=block_size)
+            self.fs.pipe_file(cache_url, data)
+            self._record(key, dataset, len(data))
+            return data
+        else:
+            ncpath = _download(source_url, download_location, block_size=block_size)
+            self.fs.put_file(ncpath, cache_url)
+        self._record(key, dataset, os.path.getsize(ncpath))
+        return ncpath
@@ -0,0 +1,107 @@
+import time
+
+import dask
+import numpy as np
+import xarray as xr
+from numcodecs import Blosc, Delta
+
+# Compressors tried for every variable, the repo default (zstd level 3
+# with bit shuffle) is one of them so tuning never does worse than it
+CANDIDATE_COMPRESSORS = [
+    Blosc(cname=cname, clevel=clevel, shuffle=shuffle)
+    for cname, clevel in (("zstd", 1), ("zstd", 3), ("zstd", 5), ("lz4", 5))
+    for shuffle in (Blosc.SHUFFLE, Blosc.BITSHUFFLE)
+]
+
+
+def _sample(variable: xr.DataArray, sample_bytes="8MB") -> np.ndarray:
+    """Leading time steps of ``variable`` up to ``sample_bytes``"""
+    step_bytes = variable.dtype.itemsize
+    for d, s in zip(variable.dims, variable.shape):
+        if d != "time":
+            step_bytes *= s
+    n_steps = max(dask.utils.parse_bytes(sample_bytes) // max(step_bytes, 1), 1)
+    return np.ascontiguousarray(variable.isel(time=slice(0, n_steps)).values)
+
+
+def _quantize(sample: np.ndarray, enc: dict) -> np.ndarray:
+    """``sample`` as it reads back from a store with encoding ``enc``"""
+    stored = sample.astype(enc.get("dtype", sample.dtype))
+    for f in enc.get("filters") or []:
+        stored = f.decode(f.encode(stored))
+    return np.asarray(stored).reshape(sample.shape)
+
+
+def _encode(sample: np.ndarray, compressor, filters=None) -> bytes:
+    buf = sample
+    for f in filters or []:
+        buf = f.encode(buf)
+    return compressor.encode(buf)
+
+
+def _candidate_filters(sample: np.ndarray) -> list:
+    """
+    Filter chains worth trying on ``sample``. Delta only for monotonic
+    integers, on floats it does not round trip exactly.
+    """
+    candidates = [None]
+    if (
+        sample.ndim == 1
+        and sample.size > 1
+        and np.issubdtype(sample.dtype, np.integer)
+        and np.all(np.diff(sample) >= 0)
+    ):
+        candidates.append([Delta(dtype=sample.dtype)])
+    return candidates
+
+
+def _trial(sample: np.ndarray, compressor, filters) -> tuple:
+    """Encoded size and encode plus decode seconds of one codec chain"""
+    start = time.perf_counter()
+    encoded = _encode(sample, compressor, filters)
+    decoded = compressor.decode(encoded)
+    for f in reversed(filters or []):
+        decoded = f.decode(decoded)
+    elapsed = time.perf_counter() - start
+    roundtrip = np.frombuffer(decoded, dtype=sample.dtype).reshape(sample.shape)
+    if not np.array_equal(roundtrip, sample, equal_nan=sample.dtype.kind in "fc"):
+        return None
+    return len(encoded), elapsed
+
+
+def tune_codecs(chunked_ds, raw_enc, bandwidth="100MB"):
+    """
+    Pick the compressor and filters of every variable in ``raw_enc`` by
+    trial encoding a sample of it from ``chunked_ds``.
+
+    Each codec chain is scored by the time to move the encoded sample at
+    ``bandwidth`` bytes per second plus the time to encode and decode it,
+    so a low bandwidth favors compression ratio and a high one favors fast
+    codecs. The winner is written into ``raw_enc`` and ends up in the
+    store metadata, where ``_get_var_encoding`` picks it up on appends.
+    Dtypes and filters already in ``raw_enc`` are kept, trials run on the
+    values they leave.
+    """
+    bandwidth = dask.utils.parse_bytes(bandwidth)
+    for k, enc in raw_enc.items():
+        v = chunked_ds[k]
+        if "time" not in v.dims or v.dtype.kind not in "biuf":
+            continue
+        sample = _quantize(_sample(v), enc)
+        if sample.size == 0:
+            continue
+        best = None
+        for filters in _candidate_filters(sample):
+            for compressor in CANDIDATE_COMPRESSORS:
+                result = _trial(sample, compressor, filters)
+                if result is None:
+                    continue
+                nbytes, elapsed = result
+                score = nbytes / bandwidth + elapsed
+                if best is None or score < best[0]:
+                    best = (score, compressor, filters)
+        if best is not None:
+            enc["compressor"] = best[1]
+            if best[2] is not None:
+                enc["filters"] = [*(enc.get("filters") or []), *best[2]]
+    return raw_enc
@@ -0,0 +1,161 @@
+import json
+from datetime import datetime, timezone
+
+import zarr
+from loguru import logger
+
+from .utils import _commit_zarr
+
+
+class IngestJournal:
+    """
+    Record of the netcdf files already committed to a zarr store, so a
+    retried ``data_processing`` resumes where the previous attempt stopped.
+
+    The journal is a single json file, e.g. under
+    ``{FLOW_PROCESS_BUCKET}/harvest-journal/{table_name}``. For every
+    committed file it keeps the file's time range and the number of
+    samples it added. The time length of each array is kept once, as of
+    the last commit, or as of ``begin`` for a store that existed before
+    the first one. A journal written for a different ``data_response`` or
+    target store is ignored, since it describes another data request.
+    """
+
+    def __init__(self, fs, path: str, data_response: str, target: str):
+        self.fs = fs
+        self.path = path
+        self.data_response = data_response
+        self.target = target
+        self._journal = self._read()
+
+    def _empty(self) -> dict:
+        return {
+            "data_response": self.data_response,
+            "target": self.target,
+            "lengths": None,
+            "files": {},
+        }
+
+    def _read(self) -> dict:
+        if self.fs.exists(self.path):
+            with self.fs.open(self.path, mode="r") as f:
+                journal = json.load(f)
+            if (
+                journal.get("data_response") == self.data_response
+                and journal.get("target") == self.target
+            ):
+                return journal
+            logger.info("Ingest journal belongs to another data request, starting over.")
+        return self._empty()
+
+    def _write(self):
+        with self.fs.open(self.path, mode="w") as f:
+            json.dump(self._journal, f)
+
+    @property
+    def committed(self) -> dict:
+        return self._journal["files"]
+
+    @property
+    def lengths(self):
+        """Time length of every array as of the last commit, None before any"""
+        return self._journal.get("lengths")
+
+    def is_committed(self, name: str) -> bool:
+        return name in self.committed
+
+    @staticmethod
+    def _lengths(state) -> dict:
+        lengths = {}
+        for key, var in state.variables.items():
+            if state.append_dim in var.dims:
+                lengths[key] = state.shapes[key][var.dims.index(state.append_dim)]
+        return lengths
+
+    def begin(self, state):
+        """
+        Record the array lengths of an existing store before anything is
+        appended to it, so an attempt that fails before its first commit
+        is rolled back as well. Kept as is once recorded.
+        """
+        if self.lengths is None:
+            self._journal["lengths"] = self._lengths(state)
+            self._write()
+
+    def commit(self, datasets: list, state, skipped: bool = False):
+        """
+        Mark ``datasets`` as written to the store of ``state`` (a
+        ``ZarrStoreState``) and record the time length of every array
+        once they are in it.
+        """
+        if not datasets:
+            return
+        lengths = self._lengths(state)
+        previous = (self.lengths or {}).get(state.append_dim, 0)
+        samples = lengths.get(state.append_dim, 0) - previous
+        generation = state.generation
+        committed_at = datetime.now(timezone.utc).isoformat()
+        for d in datasets:
+            self.committed[d.get("name")] = {
+                "order": len(self.committed),
+                "start_ts": d.get("start_ts"),
+                "end_ts": d.get("end_ts"),
+                # a coalesced batch is recorded on its first file
+                "samples": samples,
+                "generation": generation,
+                "skipped": skipped,
+                "committed_at": committed_at,
+            }
+            samples = 0
+        self._journal["lengths"] = lengths
+        self._write()
+
+    def rollback(self, store) -> bool:
+        """
+        Shrink arrays of ``store`` back to the lengths recorded with the
+        last commit, or with ``begin``, dropping anything a failed attempt
+        appended after it. Arrays created by that attempt are removed, the
+        files that brought them are appended again. The store metadata is
+        republished afterwards.
+
+        Returns
+        -------
+        bool
+            True when the store had to be rolled back.
+        """
+        lengths = self.lengths
+        if lengths is None:
+            return False
+        zg = zarr.open_group(store, mode="r+")
+        rolled_back = False
+        for key, arr in list(zg.arrays()):
+            dims = arr.attrs.get("_ARRAY_DIMENSIONS", [])
+            if "time" not in dims:
+                continue
+            if key not in lengths:
+                logger.warning(f"Removing {key}, created after the last commit.")
+                del zg[key]
+                rolled_back = True
+                continue
+            axis = dims.index("time")
+            length = lengths[key]
+            if arr.shape[axis] > length:
+                logger.warning(
+                    f"Rolling {key} back from {arr.shape[axis]} to {length} samples."
+                )
+                shape = list(arr.shape)
+                shape[axis] = length
+                arr.resize(*shape)
+                rolled_back = True
+        # the previous attempt may have deferred its commit, republish
+        # the metadata from the arrays themselves either way
+        _commit_zarr(store)
+        return rolled_back
+
+    def reset(self):
+        self._journal = self._empty()
+        self._write()
+
+    def clear(self):
+        if self.fs.exists(self.path):
+            self.fs.rm(self.path)
@@ -0,0 +1,82 @@
+import fnmatch
+
+import numpy as np
+import xarray as xr
+from loguru import logger
+from numcodecs import BitRound
+
+from .codecs import _sample, _quantize
+from .utils import _fits_dtype
+
+
+def _find_policy(name: str, variable: xr.DataArray, policy: dict):
+    """
+    Policy of a variable, by netcdf name, then data product identifier,
+    then the first matching name pattern.
+    """
+    if name in policy:
+        return policy[name]
+    product = variable.attrs.get("data_product_identifier")
+    if product in policy:
+        return policy[product]
+    for key, value in policy.items():
+        if fnmatch.fnmatchcase(name, key):
+            return value
+    return None
+
+
+def apply_precision_policy(chunked_ds, raw_enc, policy: dict, verify=False) -> dict:
+    """
+    Reduce the stored precision of the variables in ``raw_enc`` following
+    ``policy``, a table of ``{"dtype": ..., "keepbits": ...}`` entries
+    keyed by netcdf name, data product identifier or name pattern (see
+    ``data_vent.config.PRECISION_POLICY``). ``dtype`` downcasts the stored
+    array and ``keepbits`` adds a ``BitRound`` filter keeping that many
+    mantissa bits of floats. Only the encoding changes, the data is cast
+    and rounded by zarr on write.
+
+    Integer downcasts are skipped when the values or fill value of the
+    variable don't fit the smaller type, values appended later are checked
+    against it by ``_check_stored_dtypes``. With ``verify`` the largest
+    absolute error of the policy over a sample of each variable is logged.
+
+    Returns
+    -------
+    dict
+        Largest absolute error of every variable the policy changed,
+        only filled in with ``verify``.
+    """
+    errors = {}
+    for k, enc in raw_enc.items():
+        v = chunked_ds[k]
+        rule = _find_policy(k, v, policy)
+        if rule is None or v.dtype.kind not in "iuf":
+            continue
+        sample = _sample(v)
+        new_enc = {}
+        dtype = np.dtype(rule.get("dtype", enc.get("dtype", v.dtype)))
+        if dtype != v.dtype:
+            if dtype.kind in "iu":
+                fill = np.asarray([enc.get("_FillValue", 0)])
+                if v.dtype.kind == "f" or not (
+                    _fits_dtype(v.data, dtype) and _fits_dtype(fill, dtype)
+                ):
+                    logger.warning(f"{k} values don't fit {dtype}, keeping {v.dtype}.")
+                    dtype = v.dtype
+            if dtype != v.dtype:
+                new_enc["dtype"] = dtype
+        if rule.get("keepbits") is not None and dtype.kind == "f":
+            new_enc["filters"] = [*(enc.get("filters") or []), BitRound(rule["keepbits"])]
+        if not new_enc:
+            continue
+        enc.update(new_enc)
+
+        if verify and sample.size:
+            quantized = _quantize(sample, enc).astype("float64")
+            diff = np.abs(quantized - sample.astype("float64"))
+            errors[k] = float(np.nanmax(diff)) if np.isfinite(diff).any() else 0.0
+            logger.info(
+                f"Precision of {k}: {v.dtype} -> {enc.get('dtype', v.dtype)}, "
+                f"keepbits {rule.get('keepbits')}, max error {errors[k]:.6g}"
+            )
+    return errors
@@ -0,0 +1,172 @@
+import numpy as np
+import xarray as xr
+import zarr
+
+from data_vent.exceptions import DimensionChangedError
+from . import (
+    get_logger,
+    _validate_dims,
+    _prepare_existing_zarr,
+    _prepare_ds_to_append,
+    _check_stored_dtypes,
+    _write_scheduler,
+    ZarrStoreState,
+)
+
+
+def _netcdf_time_header(source_url):
+    """
+    Time length, first and last time of a netcdf file, and whether its
+    dimension coordinates are free of missing values. Only the header and
+    the dimension coordinates are read, with ranged requests when remote.
+    """
+    if source_url.startswith(("http://", "https://")):
+        # netcdf-c byte-range mode, only the blocks read are fetched
+        source_url = f"{source_url}#mode=bytes"
+    with xr.open_dataset(source_url, engine="netcdf4", decode_times=False) as ds:
+        if "obs" in ds.dims:
+            ds = ds.swap_dims({"obs": "time"})
+        times = ds["time"].values
+        valid = not any(
+            bool(ds[dim].isnull().any()) for dim in ds.dims if dim in ds.variables
+        )
+    return {
+        "length": times.size,
+        "first": times[0] if times.size else np.nan,
+        "last": times[-1] if times.size else np.nan,
+        "valid": valid,
+    }
+
+
+def plan_regions(datasets, async_url, logger=None):
+    """
+    Lay out netcdf files back to back along time from their headers, so
+    a store can be created at its final size and each file written into
+    its own region. Files an append would skip, with missing dimension
+    values, are left out. A file that is skipped or changes length in
+    preprocessing ends the plan, the store is cut after the files before
+    it and the rest is appended.
+
+    Parameters
+    ----------
+    datasets : list
+        Dataset dictionaries from the thredds catalog, in time order.
+    async_url : str
+        Url of the async results folder holding the netcdf files.
+
+    Returns
+    -------
+    dict or None
+        ``(start, stop)`` time slice of every planned file by name. None
+        when files overlap in time, they need the overlap trimming of
+        appends.
+    """
+    if logger is None:
+        logger = get_logger()
+    regions = {}
+    offset = 0
+    last = None
+    for d in datasets:
+        # one at a time, netcdf-c is not thread safe
+        header = _netcdf_time_header("/".join([async_url, d.get("name")]))
+        if not header["valid"]:
+            logger.warning(f"SKIPPED: {d.get('name')} has missing dimension values.")
+            continue
+        if header["length"] == 0:
+            continue
+        if last is not None and not header["first"] > last:
+            logger.info(f"{d.get('name')} overlaps the previous file, appending instead.")
+            return None
+        regions[d.get("name")] = (offset, offset + header["length"])
+        offset += header["length"]
+        last = header["last"]
+    return regions
+
+
+def _resize_time(store, length, append_dim="time"):
+    """Resize every array of a store along ``append_dim`` to ``length``"""
+    zg = zarr.open_group(store, mode="r+")
+    for _, arr in zg.arrays():
+        dims = arr.attrs.get("_ARRAY_DIMENSIONS", [])
+        if append_dim in dims:
+            shape = list(arr.shape)
+            shape[dims.index(append_dim)] = length
+            arr.resize(*shape)
+
+
+def write_region(
+    mod_ds,
+    store,
+    encoding,
+    region,
+    overwrite_attrs,
+    logger=None,
+    write_concurrency=1,
+    state=None,
+    commit=True,
+):
+    """
+    Write ``mod_ds`` into the ``(start, stop)`` time slice of a store
+    created at its final size, the counterpart of ``append_to_zarr`` for
+    pre-sized stores. Variables new to the store are created at full
+    length, variables missing from ``mod_ds`` or not aligned with the
+    store are filled in like on append. The caller makes sure the dataset
+    is as long as the region, see ``plan_regions``.
+    """
+    if logger is None:
+        logger = get_logger()
+    if state is None:
+        state = ZarrStoreState(store)
+    start, stop = region
+    if mod_ds.sizes["time"] != stop - start:
+        raise ValueError(
+            f"Dataset has {mod_ds.sizes['time']} samples for a region of {stop - start}."
+        )
+
+    if overwrite_attrs:
+        logger.info("Overwriting existing zarr global and variable attributes.")
+        state.group.attrs.update(mod_ds.attrs)
+        for var_name in mod_ds.data_vars:
+            if var_name in state:
+                state.group[var_name].attrs.update(mod_ds[var_name].attrs)
+                state.mark(f"{var_name}/.zattrs")
+        state.mark(".zattrs")
+
+    _prepare_existing_zarr(store, mod_ds, enc=encoding, state=state)
+    mod_ds = _prepare_ds_to_append(store, mod_ds, state=state)
+    dim_indexer, modify_zarr_dims, issue_dims = _validate_dims(
+        mod_ds, state, append_dim="time"
+    )
+    if len(issue_dims) > 0:
+        # files with missing dimension values are left out of the plan
+        raise ValueError(f"{','.join(issue_dims)} dimension(s) are problematic.")
+    if modify_zarr_dims:
+        changed = {d: (state.shapes[d][0], len(v)) for d, v in dim_indexer.items()}
+        raise DimensionChangedError(
+            f"Non-time dimension size increased: {changed}. "
+            "Run with refresh=True to rewrite the store at the new dimension size."
+        )
+    elif dim_indexer:
+        logger.info("Reindexing dataset to write ...")
+        mod_ds = mod_ds.reindex(dim_indexer)
+
+    # everything without time was written along with the store
+    mod_ds = mod_ds.drop_vars([k for k, v in mod_ds.variables.items() if "time" not in v.dims])
+    _check_stored_dtypes(mod_ds, state)
+    logger.info(f"Writing zarr region {start}:{stop}.")
+    with _write_scheduler(write_concurrency):
+        mod_ds.to_zarr(
+            store,
+            consolidated=False,
+            compute=True,
+            region={"time": slice(start, stop)},
+            safe_chunks=False,
+            write_empty_chunks=False,
+        )
+        # region writes leave index coordinates alone
+        state.group["time"][start:stop] = mod_ds["time"].values
+
+    if commit:
+        generation = state.commit()
+        logger.info(f"Committed zarr generation {generation}.")
+    return True
@@ -0,0 +1,241 @@
+import dask
+import dask.array as da
+import zarr
+from rechunker import rechunk
+from rechunker.algorithm import prod
+
+from data_vent.utils.time_index import read_time_index, update_time_index
+from . import get_logger, is_zarr_ready, _commit_zarr
+from .utils import _clear_store
+
+
+def _replica_zarr(final_zarr):
+    """Analysis replica of ``final_zarr``, rechunked for time series access"""
+    return f"{final_zarr.rstrip('/').removesuffix('.zarr')}__analysis.zarr"
+
+
+def _array_dims(arr):
+    return arr.attrs.get("_ARRAY_DIMENSIONS", [])
+
+
+def _replica_chunks(group, chunk_size="50MB", append_dim="time"):
+    """
+    Target chunks of every array of ``group``. Arrays along ``append_dim``
+    get one element of every other dimension per chunk and as many time
+    steps as fit in ``chunk_size``, so a whole time series of one bin or
+    wavelength is a handful of chunks. The others are copied as they are.
+    """
+    chunk_size = dask.utils.parse_bytes(chunk_size)
+    target_chunks = {}
+    for name, arr in group.arrays():
+        dims = _array_dims(arr)
+        if append_dim not in dims:
+            target_chunks[name] = None
+            continue
+        # sized for the series to come, not the length of a young store
+        steps = max(chunk_size // arr.dtype.itemsize, 1)
+        target_chunks[name] = tuple(steps if d == append_dim else 1 for d in dims)
+    return target_chunks
+
+
+def _is_replica_of(source, replica, append_dim="time"):
+    """
+    Whether ``replica`` holds a leading part of ``source``: same arrays,
+    same sizes along every other dimension and the same first and last
+    time values. Anything else, like a refreshed source, needs a rebuild.
+    """
+    names = {name for name, _ in source.arrays()}
+    if names != {name for name, _ in replica.arrays()}:
+        return False
+    for name in names:
+        dims = _array_dims(source[name])
+        src_shape, rep_shape = source[name].shape, replica[name].shape
+        for i, d in enumerate(dims):
+            if d == append_dim and src_shape[i] < rep_shape[i]:
+                return False
+            if d != append_dim and src_shape[i] != rep_shape[i]:
+                return False
+    length = replica[append_dim].shape[0]
+    if length == 0:
+        return True
+    return all(source[append_dim][i] == replica[append_dim][i] for i in (0, length - 1))
+
+
+def _blocks(start, stop, block):
+    """``(start, stop)`` slices of at most ``block``, on multiples of it"""
+    while start < stop:
+        end = min((start // block + 1) * block, stop)
+        yield start, end
+        start = end
+
+
+def _copy_whole_series(arr, group, name, chunks, max_mem="1GB", append_dim="time"):
+    """
+    Copy ``arr`` into a new array of ``group`` with ``chunks`` longer than
+    it along ``append_dim``, which rechunker can't plan. Each bin is a
+    single chunk, written as many bins at a time as fit in ``max_mem``.
+    """
+    target = group.create(
+        name,
+        shape=arr.shape,
+        chunks=chunks,
+        dtype=arr.dtype,
+        compressor=arr.compressor,
+        filters=arr.filters,
+        fill_value=arr.fill_value,
+    )
+    target.attrs.put(dict(arr.attrs))
+    axis = _array_dims(arr).index(append_dim)
+    source = da.from_zarr(arr).rechunk(
+        {i: -1 if i == axis else "auto" for i in range(arr.ndim)},
+        block_size_limit=dask.utils.parse_bytes(max_mem),
+    )
+    da.store(source, target, lock=False)
+
+
+def build_replica(source_store, replica_store, temp_store, chunk_size="50MB", max_mem="1GB"):
+    """
+    Write a rechunked copy of ``source_store`` into ``replica_store`` with
+    rechunker, see ``_replica_chunks``. Compressors, filters and fill values
+    of the source arrays are kept. Arrays still shorter than a replica chunk
+    are copied with ``_copy_whole_series`` instead. Anything in the replica
+    and temp stores is removed first.
+    """
+    source = zarr.open_consolidated(source_store)
+    _clear_store(replica_store)
+    _clear_store(temp_store)
+    target_chunks = _replica_chunks(source, chunk_size)
+    # series shorter than a replica chunk are copied as they are
+    whole = {
+        name: chunks
+        for name, chunks in target_chunks.items()
+        if chunks is not None and any(c > s for c, s in zip(chunks, source[name].shape))
+    }
+    if len(whole) < len(target_chunks):
+        target_options = {
+            name: {"compressor": arr.compressor, "filters": arr.filters}
+            for name, arr in source.arrays()
+        }
+        plan = rechunk(
+            source,
+            {name: chunks for name, chunks in target_chunks.items() if name not in whole},
+            max_mem,
+            replica_store,
+            target_options=target_options,
+            temp_store=temp_store,
+        )
+        plan.execute()
+    replica = zarr.open_group(replica_store, mode="a")
+    replica.attrs.put(dict(source.attrs))
+    for name, chunks in whole.items():
+        _copy_whole_series(source[name], replica, name, chunks, max_mem=max_mem)
+    # rechunker creates arrays without fill values, xarray reads them as _FillValue
+    for name, arr in source.arrays():
+        if arr.fill_value is not None:
+            replica[name].fill_value = arr.fill_value
+    _clear_store(temp_store)
+    _commit_zarr(replica_store, time_index=update_time_index(replica["time"]))
+
+
+def extend_replica(source_store, replica_store, max_mem="1GB", append_dim="time"):
+    """
+    Copy the samples ``source_store`` gained since ``replica_store`` was
+    last updated, reading at most ``max_mem`` of the source at a time.
+    Attributes are brought up to date as well. The last, partial replica
+    chunk of every array is read and written again with the new samples.
+
+    Returns
+    -------
+    int
+        Number of samples copied.
+    """
+    source = zarr.open_consolidated(source_store)
+    # length as last committed, an interrupted update may have resized arrays
+    start = zarr.open_consolidated(replica_store)[append_dim].shape[0]
+    replica = zarr.open_group(replica_store, mode="r+")
+    stop = source[append_dim].shape[0]
+    max_mem = dask.utils.parse_bytes(max_mem)
+
+    changed_keys = []
+    if dict(replica.attrs) != dict(source.attrs):
+        replica.attrs.put(dict(source.attrs))
+        changed_keys.append(".zattrs")
+    for name, arr in source.arrays():
+        target = replica[name]
+        if dict(target.attrs) != dict(arr.attrs):
+            target.attrs.put(dict(arr.attrs))
+            changed_keys.append(f"{name}/.zattrs")
+        dims = _array_dims(arr)
+        if append_dim not in dims or stop == start:
+            continue
+        axis = dims.index(append_dim)
+        shape = list(target.shape)
+        shape[axis] = stop
+        target.resize(*shape)
+        changed_keys.append(f"{name}/.zarray")
+
+        step_bytes = arr.dtype.itemsize * prod(s for i, s in enumerate(arr.shape) if i != axis)
+        block = max(max_mem // step_bytes, 1)
+        time_chunk = target.chunks[axis]
+        if block >= time_chunk:
+            # whole replica chunks per block, none of them is written twice
+            block -= block % time_chunk
+        for lo, hi in _blocks(start, stop, block):
+            selection = [slice(None)] * len(dims)
+            selection[axis] = slice(lo, hi)
+            target[tuple(selection)] = arr[tuple(selection)]
+
+    if changed_keys:
+        time_index = None
+        if stop > start:
+            time_index = update_time_index(replica[append_dim], read_time_index(replica_store))
+        _commit_zarr(replica_store, changed_keys=changed_keys, time_index=time_index)
+    return stop - start
+
+
+def update_replica(
+    source_store,
+    replica_store,
+    temp_store,
+    chunk_size="50MB",
+    max_mem="1GB",
+    rebuild=False,
+    logger=None,
+):
+    """
+    Keep the analysis replica of a store up to date. It is extended with
+    the new samples of the store when it still holds a leading part of it,
+    and rebuilt from scratch otherwise or with ``rebuild`` set.
+
+    Parameters
+    ----------
+    source_store, replica_store : fsspec.mapping.FSMap
+        The zarr store and its analysis replica
+    temp_store : fsspec.mapping.FSMap
+        Scratch store for the intermediate arrays of rechunker
+    chunk_size : str
+        Uncompressed size of the replica chunks along time
+    max_mem : str
+        Memory budget for reading the source store
+    rebuild : bool
+        Always rebuild the replica, e.g. after the source was refreshed
+    """
+    if logger is None:
+        logger = get_logger()
+    if not rebuild and is_zarr_ready(replica_store):
+        source = zarr.open_consolidated(source_store)
+        replica = zarr.open_consolidated(replica_store)
+        rebuild = not _is_replica_of(source, replica)
+        if rebuild:
+            logger.info("Analysis replica no longer matches its store.")
+    else:
+        rebuild = True
+
+    if rebuild:
+        logger.info("Building analysis replica with rechunker.")
+        build_replica(
+            source_store, replica_store, temp_store, chunk_size=chunk_size, max_mem=max_mem
+        )
+    else:
+        n_samples = extend_replica(source_store, replica_store, max_mem=max_mem)
+        logger.info(f"Copied {n_samples} new samples into the analysis replica.")
@@ -0,0 +1,155 @@
+import json
+
+import zarr
+from xarray.backends.zarr import ZarrStore
+
+from data_vent.utils.time_index import (
+    TIME_INDEX_KEY,
+    get_time_index,
+    update_time_index,
+    build_time_index,
+)
+from .utils import _get_var_encoding, _commit_zarr, _write_zmetadata
+
+
+class ZarrStoreState:
+    """
+    Schema of a zarr store shared by the append helpers for a whole run.
+
+    Array shapes, chunks, encodings, the xarray view of every variable and
+    the non-time coordinate values are read once, from the consolidated
+    metadata when there is one, and kept up to date in place after every
+    append instead of being re-read from S3 for each file.
+
+    The published ``.zmetadata`` is patched the same way: appended array
+    shapes are updated in memory and only metadata keys rewritten during
+    the run are read back on ``commit``. So is its time index, which is
+    built from the time array the first time a store without one is
+    appended to.
+    """
+
+    def __init__(self, store, append_dim: str = "time"):
+        self.store = store
+        self.append_dim = append_dim
+        self.refresh()
+
+    def refresh(self):
+        """Drop everything cached and read the store schema again"""
+        published = self.store.get(".zmetadata")
+        self.time_index = None
+        if published is None:
+            self._published = None
+            self._read_group = zarr.open_group(self.store, mode="r")
+        else:
+            # same as zarr.open_consolidated, keeping hold of the metadata
+            self._published = json.loads(published)
+            self.time_index = get_time_index(self._published)
+            meta_store = zarr.storage.KVStore(self._published["metadata"])
+            self._read_group = zarr.open_group(meta_store, mode="r", chunk_store=self.store)
+        self._dirty = set()
+        self._group = None
+        self._coords = {}
+        self._tail = None
+        self.variables = dict(ZarrStore(self._read_group).get_variables())
+        self.shapes = {}
+        self.chunks = {}
+        self.encodings = {}
+        for name, arr in self._read_group.arrays():
+            self._track(name, arr)
+
+    def _track(self, name, arr):
+        self.shapes[name] = arr.shape
+        self.chunks[name] = arr.chunks
+        self.encodings[name] = _get_var_encoding(arr)
+
+    @property
+    def group(self) -> zarr.Group:
+        """Writable group handle, opened on first use"""
+        if self._group is None:
+            self._group = zarr.open_group(self.store, mode="a")
+        return self._group
+
+    @property
+    def generation(self) -> int:
+        """Commit generation of the metadata this state was read from"""
+        if self._published is None:
+            return 0
+        return self._published.get("commit_generation", 0)
+
+    def mark(self, *keys):
+        """Flag metadata keys written outside of the append helpers"""
+        self._dirty.update(keys)
+
+    def __contains__(self, name) -> bool:
+        return name in self.shapes
+
+    def coordinate(self, dim):
+        """Values of the ``dim`` coordinate, read once per run"""
+        if dim not in self._coords:
+            self._coords[dim] = self._read_group[dim][:]
+        return self._coords[dim]
+
+    def tail(self):
+        """Last value along the append dimension"""
+        if self._tail is None and self.time_index is not None:
+            self._tail = self.time_index["end"]
+        if self._tail is None:
+            self._tail = self._read_group[self.append_dim][-1]
+        return self._tail
+
+    def add_array(self, name, arr):
+        """Track an array created in the store during this run"""
+        self._track(name, arr)
+        self.variables[name] = ZarrStore(self.group).open_store_variable(name, arr)
+        self.mark(f"{name}/.zarray", f"{name}/.zattrs")
+
+    def appended(self, ds):
+        """Account for ``ds`` having been appended along the append dimension"""
+        n = ds.sizes[self.append_dim]
+        if n == 0:
+            return
+        if self._published is not None and self.append_dim in self.shapes:
+            # read before the shapes below move past the appended data
+            self.time_index = update_time_index(
+                self._read_group[self.append_dim], self.time_index
+            )
+            build_time_index(ds[self.append_dim].values, None, self.time_index)
+        created = self._dirty_arrays()
+        for name, var in ds.variables.items():
+            if self.append_dim in var.dims and name in self.shapes:
+                shape = list(self.shapes[name])
+                shape[var.dims.index(self.append_dim)] += n
+                self.shapes[name] = tuple(shape)
+                if self._published is not None and name not in created:
+                    self._published["metadata"][f"{name}/.zarray"]["shape"] = shape
+        self._tail = ds[self.append_dim].data[-1]
+        # to_zarr rewrites the group attributes on append
+        self.mark(".zattrs")
+
+    def _dirty_arrays(self):
+        # arrays created this run, their metadata is read back on commit
+        return {key.rsplit("/", 1)[0] for key in self._dirty if key.endswith("/.zarray")}
+
+    def commit(self) -> int:
+        """
+        Publish every change made through this state since the last commit
+        in a single ``.zmetadata`` write.
+
+        Returns
+        -------
+        int
+            The generation that was published.
+        """
+        if self._published is None:
+            generation = _commit_zarr(self.store)
+            self.refresh()
+            return generation
+        metadata = self._published["metadata"]
+        for key in self._dirty:
+            metadata[key] = json.loads(self.store[key])
+        generation = self.generation + 1
+        _write_zmetadata(self.store, metadata, generation, time_index=self.time_index)
+        self._published[TIME_INDEX_KEY] = self.time_index
+        self._published["commit_generation"] = generation
+        self._dirty.clear()
+        return generation
@@ -0,0 +1,236 @@
+import json
+
+import fsspec
+import zarr
+import xarray as xr
+
+from data_vent.utils.time_index import (
+    build_time_index,
+    get_time_index,
+    read_time_index,
+    truncate_time_index,
+)
+from . import (
+    append_to_zarr,
+    chunk_ds,
+    get_logger,
+    is_zarr_ready,
+    _commit_zarr,
+    ZarrStoreState,
+)
+from .utils import (
+    _copy_zarr_store,
+    _store_keys,
+    _delete_keys,
+    _clear_store,
+    _write_zmetadata,
+    _zarr_generation,
+)
+
+
+def _tail_zarr(final_zarr):
+    """Tail store holding the most recent data of ``final_zarr`` in small chunks"""
+    return f"{final_zarr.rstrip('/').removesuffix('.zarr')}__tail.zarr"
+
+
+def _compaction_span(state, append_dim="time"):
+    """
+    Largest time chunk of a store. Spans of this many samples are moved
+    out of the tail as a whole, so the arrays with the largest chunks only
+    ever get full chunks written and the rest at most one partial chunk
+    per compaction.
+    """
+    return max(
+        state.chunks[k][v.dims.index(append_dim)]
+        for k, v in state.variables.items()
+        if append_dim in v.dims
+    )
+
+
+def _staged_tail(tail_store):
+    """Store the rewritten tail is staged in during a compaction"""
+    return tail_store.fs.get_mapper(f"{tail_store.root.rstrip('/')}__next")
+
+
+def _truncate_time(store, length, append_dim="time"):
+    """
+    Cut every array of a committed store along ``append_dim`` to
+    ``length``. The shorter shapes and time index are published before
+    any array is resized, resizing deletes the chunks past the new end
+    and readers of the old metadata would find them missing.
+    """
+    published = json.loads(store[".zmetadata"])
+    time_index = get_time_index(published)
+    metadata = published["metadata"]
+    zg = zarr.open_group(store, mode="r+")
+    cut = []
+    for name, arr in zg.arrays():
+        dims = arr.attrs.get("_ARRAY_DIMENSIONS", [])
+        if append_dim in dims and arr.shape[dims.index(append_dim)] > length:
+            shape = list(arr.shape)
+            shape[dims.index(append_dim)] = length
+            metadata[f"{name}/.zarray"]["shape"] = shape
+            cut.append((arr, shape))
+    if time_index is not None:
+        time_index = truncate_time_index(zg[append_dim], time_index, length)
+    _write_zmetadata(
+        store, metadata, published.get("commit_generation", 0) + 1, time_index=time_index
+    )
+    for arr, shape in cut:
+        arr.resize(*shape)
+
+
+def _swap_tail(staged_store, tail_store):
+    """
+    Replace the tail store with the one staged next to it. The tail
+    metadata is taken down first, so readers only see the main store
+    until the new tail is published, never new chunks under old shapes.
+    """
+    generation = _zarr_generation(tail_store) + 1
+    tail_store.pop(".zmetadata", None)
+    keys = _copy_zarr_store(staged_store, tail_store, excludes=[r"^\.zmetadata$"])
+    _delete_keys(tail_store, _store_keys(tail_store) - keys)
+    _commit_zarr(
+        tail_store, time_index=read_time_index(staged_store), generation=generation
+    )
+    _clear_store(staged_store)
+
+
+def recover_tail_store(tail_store, logger=None):
+    """
+    Finish swapping in a tail store staged by a compaction that was
+    interrupted after taking the old tail down. Call before deciding
+    whether a stream has a tail store.
+    """
+    if logger is None:
+        logger = get_logger()
+    staged_store = _staged_tail(tail_store)
+    if is_zarr_ready(tail_store) or not is_zarr_ready(staged_store):
+        return
+    logger.warning("Finishing an interrupted tail store compaction.")
+    _swap_tail(staged_store, tail_store)
+
+
+def _write_tail(ds, tail_store, max_chunk="4MB"):
+    ds = ds.copy()
+    for k, v in ds.variables.items():
+        # only keep what chunk_ds doesn't set, chunks come from max_chunk
+        v.encoding = {e: v.encoding[e] for e in ("_FillValue",) if e in v.encoding}
+    mod_ds, enc = chunk_ds(ds, max_chunk=max_chunk, time_max_chunks=max_chunk, apply=True)
+    mod_ds.to_zarr(
+        tail_store,
+        consolidated=False,
+        compute=True,
+        mode="w",
+        encoding=enc,
+        write_empty_chunks=False,
+    )
+    _commit_zarr(
+        tail_store,
+        time_index=build_time_index(mod_ds["time"].values, enc["time"]["chunks"][0]),
+    )
+
+
+def init_tail_store(final_store, tail_store, max_chunk="4MB", logger=None):
+    """
+    Split a zarr store into a main store made of whole compaction spans and
+    a tail store with the rest of the samples, so daily appends only ever
+    write small tail chunks. At least one sample always stays in the tail,
+    it is what the next append is checked against for overlap.
+
+    Returns
+    -------
+    bool
+        False when the store is shorter than one span and was left as is.
+    """
+    if logger is None:
+        logger = get_logger()
+    state = ZarrStoreState(final_store)
+    length = state.shapes["time"][0]
+    span = _compaction_span(state)
+    split = ((length - 1) // span) * span
+    if split == 0:
+        logger.info("Store is shorter than a chunk span, not splitting off a tail store.")
+        return False
+    logger.info(f"Moving the last {length - split} samples into a new tail store.")
+    ds = xr.open_zarr(final_store, consolidated=True, decode_times=False)
+    _write_tail(ds.isel(time=slice(split, None)), tail_store, max_chunk=max_chunk)
+    # only shrink the main store once the tail holds the samples
+    _truncate_time(final_store, split)
+    return True
+
+
+def compact_tail_store(
+    final_store,
+    tail_store,
+    max_chunk="100MB",
+    tail_max_chunk="4MB",
+    overwrite_attrs=False,
+    full=False,
+    logger=None,
+):
+    """
+    Fold the leading whole-chunk spans of the tail store into the main
+    store and rewrite the tail with what is left. With ``full`` set the
+    whole tail is folded in and the tail store removed.
+
+    Returns
+    -------
+    int
+        Number of samples moved into the main store.
+    """
+    if logger is None:
+        logger = get_logger()
+    main_state = ZarrStoreState(final_store)
+    tail_ds = xr.open_zarr(tail_store, consolidated=True, decode_times=False)
+    tail_length = tail_ds.sizes["time"]
+    if full:
+        n_samples = tail_length
+    else:
+        span = _compaction_span(main_state)
+        n_samples = ((tail_length - 1) // span) * span
+    if n_samples == 0:
+        logger.info("Tail store holds less than a chunk span, nothing to compact.")
+        return 0
+
+    logger.info(f"Compacting {n_samples} tail samples into the main store.")
+    mod_ds, enc = chunk_ds(
+        tail_ds.isel(time=slice(0, n_samples)), max_chunk=max_chunk, apply=False
+    )
+    append_to_zarr(mod_ds, final_store, enc, overwrite_attrs, logger=logger, state=main_state)
+    if full:
+        _clear_store(tail_store)
+        return n_samples
+
+    # stage what is left next to the tail, it is still read from the tail
+    staged_store = _staged_tail(tail_store)
+    _write_tail(
+        tail_ds.isel(time=slice(n_samples, None)), staged_store, max_chunk=tail_max_chunk
+    )
+    _swap_tail(staged_store, tail_store)
+    return n_samples
+
+
+def open_tail_dataset(final_zarr, storage_options=None, **kwargs):
+    """
+    Open a zarr store together with its tail store, if it has one, as a
+    single dataset. Keyword arguments go to ``xr.open_zarr``.
+    """
+    storage_options = storage_options or {}
+    final_store = fsspec.get_mapper(final_zarr, **storage_options)
+    tail_store = fsspec.get_mapper(_tail_zarr(final_zarr), **storage_options)
+    ds = xr.open_zarr(final_store, **kwargs)
+    if not is_zarr_ready(tail_store):
+        return ds
+    tail_ds = xr.open_zarr(tail_store, **kwargs)
+    if ds.sizes["time"] > 0:
+        # samples of an interrupted compaction can be in both stores
+        tail_ds = tail_ds.isel(time=(tail_ds.time > ds.time[-1]).values)
+    return xr.concat(
+        [ds, tail_ds],
+        dim="time",
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        combine_attrs="override",
+    )
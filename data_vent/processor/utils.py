@@ -1,23 +1,58 @@
+import io
 import os
+import re
+import asyncio
+import datetime
+from typing import Optional
+import collections
+import concurrent.futures
+import contextlib
+import time
+import warnings
 import zarr
+import dask
+import dask.array as da
 import numpy as np
+import pandas as pd
 import xarray as xr
 import requests
 from loguru import logger
 import json
 import fsspec
+from fsspec.asyn import AsyncFileSystem, sync
 from pathlib import Path
 from github import Github
 
+from data_vent.exceptions import DtypeOverflowError, IncompleteRefreshError
 from data_vent.utils.encoders import NumpyEncoder
+from data_vent.utils.time_index import TIME_INDEX_KEY
 from data_vent.settings.main import harvest_settings
 
+# nanoseconds in one step of cf "<units> since <date>" times
+_TIME_UNIT_NS = {
+    "days": 86400 * 10**9,
+    "hours": 3600 * 10**9,
+    "minutes": 60 * 10**9,
+    "seconds": 10**9,
+    "milliseconds": 10**6,
+    "microseconds": 10**3,
+}
+TIME_RESOLUTIONS = {"s": "seconds", "ms": "milliseconds", "us": "microseconds"}
+_TIME_UNITS_RE = re.compile(r"^\s*(\w+)\s+since\s+(.+?)\s*$")
+
 
 def _get_var_encoding(var):
     compress = zarr.Blosc(cname="zstd", clevel=3, shuffle=2)
     enc = {
         "chunks": getattr(var, "_chunks"),
     }
+    if var.basename == "time" and np.issubdtype(getattr(var, "_dtype"), np.integer):
+        # integer time carries its own delta filter and compressor
+        enc.update(
+            compressor=getattr(var, "_compressor", compress),
+            dtype=getattr(var, "_dtype"),
+            filters=getattr(var, "_filters", None),
+        )
     if var.basename != "time":
         enc = dict(
             **{
@@ -29,6 +64,9 @@ def _get_var_encoding(var):
         fill_value = getattr(var, "_fill_value", None)
         if fill_value is not None:
             enc["_FillValue"] = fill_value
+        filters = getattr(var, "_filters", None)
+        if filters:
+            enc["filters"] = filters
     return enc
 
 
@@ -88,7 +126,7 @@ def _write_data_avail(avail_dict, gh_write=False):
             json_path.write_text(json.dumps(json_content, cls=NumpyEncoder))
 
 
-def _validate_dims(ds_to_append, existing_zarr, append_dim):
+def _validate_dims(ds_to_append, state, append_dim):
     dim_indexer = {}
     modify_zarr_dims = False
     issue_dims = []
@@ -96,78 +134,213 @@ def _validate_dims(ds_to_append, existing_zarr, append_dim):
         if any(ds_to_append[dim].isnull()):
             issue_dims.append(dim)
         if "time" not in dim:
-            existing_var = existing_zarr[dim]
-            existing_size = existing_var.shape[0]
+            existing_size = state.shapes[dim][0]
             if new_size < existing_size:
-                dim_indexer[dim] = existing_var[:].astype(ds_to_append[dim].dtype)
+                dim_indexer[dim] = state.coordinate(dim).astype(ds_to_append[dim].dtype)
             elif new_size > existing_size:
                 dim_indexer[dim] = ds_to_append[dim].values
                 modify_zarr_dims = True
     return dim_indexer, modify_zarr_dims, issue_dims
 
 
-def _prepare_existing_zarr(store, ds_to_append, enc):
-    existing_zarr = zarr.open_group(store, mode="a")
+def _can_coalesce(left, right, append_dim="time"):
+    """
+    Check that two datasets can be concatenated along ``append_dim``
+    without any reindexing, i.e. same variables, dims, dtypes and non
+    append dimension sizes and coordinate values.
+    """
+    if set(left.variables) != set(right.variables):
+        return False
+    for var_name, left_var in left.variables.items():
+        right_var = right.variables[var_name]
+        if left_var.dims != right_var.dims or left_var.dtype != right_var.dtype:
+            return False
+    for dim, size in left.sizes.items():
+        if dim == append_dim:
+            continue
+        if right.sizes.get(dim) != size:
+            return False
+        if dim in left.coords and not left[dim].equals(right[dim]):
+            return False
+    return True
+
+
+def _time_units(resolution: str) -> str:
+    """Cf units of integer time at ``resolution``, one of ``TIME_RESOLUTIONS``"""
+    reference = harvest_settings.ooi_config.time["units"].split(" since ")[1]
+    return f"{TIME_RESOLUTIONS[resolution]} since {reference}"
+
+
+def _unpack_time_units(units: str):
+    """
+    Step and reference date of cf time ``units``, e.g. ``seconds since
+    1900-01-01 0:0:0``. The reference is a timezone naive UTC timestamp.
+    """
+    match = _TIME_UNITS_RE.match(units)
+    if match is None or match.group(1).lower() not in _TIME_UNIT_NS:
+        raise ValueError(f"Unsupported time units: {units!r}")
+    step, reference = match.groups()
+    reference = pd.Timestamp(reference)
+    if reference.tzinfo is not None:
+        reference = reference.tz_convert("UTC").tz_localize(None)
+    return step.lower(), reference
+
+
+def _convert_time(ds, units, dtype="int64"):
+    """
+    Express the undecoded time of ``ds`` in ``units`` as integer ``dtype``,
+    rounding to the nearest step. Datasets with missing times are left as
+    they are, appends skip them.
+
+    Returns
+    -------
+    tuple
+        The dataset and the largest rounding error in seconds beyond the
+        precision of the source values, 0 when no detail was lost.
+    """
+    time = ds["time"]
+    source_units = time.attrs.get("units", harvest_settings.ooi_config.time["units"])
+    if (source_units == units and time.dtype == dtype) or time.isnull().any():
+        return ds, 0.0
+    source_step, source_ref = _unpack_time_units(source_units)
+    step, ref = _unpack_time_units(units)
+    offset = (source_ref - ref).value / _TIME_UNIT_NS[step]
+    scale = _TIME_UNIT_NS[source_step] / _TIME_UNIT_NS[step]
+    values = time.values * scale + offset
+    encoded = np.round(values).astype(dtype)
+    error = 0.0
+    if values.size:
+        # rounding within the precision of the source values loses nothing
+        precision = np.spacing(np.abs(time.values.astype("float64"))) * scale
+        lost = float(np.max(np.abs(encoded - values) - precision))
+        error = max(lost, 0.0) * _TIME_UNIT_NS[step] / 10**9
+    attrs = dict(time.attrs, units=units)
+    ds = ds.assign_coords(time=xr.Variable(time.dims, encoded, attrs=attrs))
+    return ds, error
+
+
+def _trim_overlap(ds_to_append, last_value, append_dim="time"):
+    """
+    Drop the leading samples of ``ds_to_append`` that are not strictly
+    after ``last_value``, the last value stored along ``append_dim``.
+
+    Returns
+    -------
+    tuple
+        The trimmed dataset and the number of samples dropped.
+    """
+    if last_value is None or np.isnan(last_value):
+        return ds_to_append, 0
+    trimmed = int(np.searchsorted(ds_to_append[append_dim].values, last_value, side="right"))
+    if trimmed:
+        ds_to_append = ds_to_append.isel({append_dim: slice(trimmed, None)})
+    return ds_to_append, trimmed
+
+
+def _fits_dtype(data, dtype) -> bool:
+    """
+    Whether the values of ``data``, a numpy or dask array, are within the
+    range of integer ``dtype``. NaNs are left out.
+    """
+    if data.size == 0:
+        return True
+    with warnings.catch_warnings():
+        # all-NaN data has no range to check
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lo, hi = dask.compute(np.nanmin(data), np.nanmax(data))
+    info = np.iinfo(dtype)
+    return not (lo < info.min or hi > info.max)
+
+
+def _check_stored_dtypes(ds_to_append, state):
+    """
+    Make sure every variable of ``ds_to_append`` stored as a narrower
+    integer type than it comes in, e.g. after a precision policy downcast,
+    fits that type. zarr would cast out of range values silently.
+    """
+    for var_name, var in ds_to_append.variables.items():
+        if var_name not in state:
+            continue
+        stored = np.dtype(state.encodings[var_name].get("dtype", var.dtype))
+        if stored.kind not in "iu" or stored == var.dtype or var.dtype.kind not in "iuf":
+            continue
+        if not _fits_dtype(var.data, stored):
+            raise DtypeOverflowError(
+                f"Values of {var_name} don't fit its stored dtype {stored}. "
+                "Widen its precision policy and run with refresh=True."
+            )
+
+
+def _prepare_existing_zarr(store, ds_to_append, enc, state=None):
+    if state is None:
+        from .state import ZarrStoreState
+
+        state = ZarrStoreState(store)
     for var_name, new_var in ds_to_append.variables.items():
-        if var_name not in existing_zarr:
+        if var_name not in state:
             logger.info(f"{var_name} not in existing zarr ... creating ...")
-            existing_arr_shape = tuple(
-                existing_zarr[dim].shape[0] for dim, size in new_var.sizes.items()
-            )
-            existing_chunks = tuple(
-                existing_zarr[dim].chunks[0] for dim, size in new_var.sizes.items()
-            )
+            existing_arr_shape = tuple(state.shapes[dim][0] for dim in new_var.dims)
+            existing_chunks = tuple(state.chunks[dim][0] for dim in new_var.dims)
             fill_value = None
             if "_FillValue" in enc[var_name]:
                 fill_value = enc[var_name]["_FillValue"]
 
-            za = existing_zarr.create(
+            za = state.group.create(
                 var_name,
                 shape=existing_arr_shape,
                 chunks=existing_chunks,
                 dtype=enc[var_name]["dtype"],
                 fill_value=fill_value,
                 compressor=enc[var_name]["compressor"],
+                filters=enc[var_name].get("filters"),
             )
 
             attributes = json.loads(json.dumps(new_var.attrs, cls=NumpyEncoder))
             attributes["_ARRAY_DIMENSIONS"] = list(new_var.dims)
 
             za.attrs.put(attributes)
+            state.add_array(var_name, za)
             logger.info(f"{var_name} creation finished.")
-    zarr.consolidate_metadata(store)
-    return existing_zarr
+    return state
 
 
-def _prepare_ds_to_append(store, ds_to_append):
+def _prepare_ds_to_append(store, ds_to_append, state=None):
     # WARNING: ONLY WORKS FOR FLOATS!!
-    from xarray.backends.zarr import ZarrStore
+    if state is None:
+        from .state import ZarrStoreState
 
-    existing_zarr = zarr.open_group(store, mode="a")
-    zs = ZarrStore(existing_zarr)
+        state = ZarrStoreState(store)
     ds_to_append = ds_to_append.unify_chunks()
 
-    for var_name, new_var in zs.get_variables().items():
+    for var_name, new_var in state.variables.items():
         existing_shape = tuple(
             ds_to_append[dim].shape[0] for dim, size in new_var.sizes.items()
         )
         existing_chunks = {dim: ds_to_append.chunks.get(dim, None) for dim in new_var.dims}
+        # placeholders stay lazy dask constants, chunked like the rest of
+        # the dataset or else like the store, so nothing is allocated
+        # beyond the chunk being written
+        fill_chunks = tuple(
+            existing_chunks[dim] or state.chunks[var_name][axis]
+            for axis, dim in enumerate(new_var.dims)
+        )
+        # the variables are shared across appends, leave their attrs intact
+        attrs = dict(new_var.attrs)
         if var_name not in ds_to_append:
             logger.info(f"{var_name} not in ds_to_append ... creating ...")
-            new_arr = np.full(
+            new_arr = da.full(
                 existing_shape,
-                new_var.attrs["_FillValue"] if "_FillValue" in new_var.attrs else np.nan,
+                attrs.pop("_FillValue", np.nan),
                 dtype=new_var.dtype,
+                chunks=fill_chunks,
             )
-            if "_FillValue" in new_var.attrs:
-                new_var.attrs.pop("_FillValue")
 
             ds_to_append[var_name] = xr.Variable(
                 dims=new_var.dims,
                 data=new_arr,
-                attrs=new_var.attrs,
+                attrs=attrs,
                 encoding=new_var.encoding,
-            ).chunk(existing_chunks)
+            )
         else:
             var_to_change = ds_to_append[var_name]
             if not (var_to_change.dims == new_var.dims) or (
@@ -176,22 +349,236 @@ def _prepare_ds_to_append(store, ds_to_append):
                 logger.info(
                     f"{var_name} is not aligned with existing variable ... modifying ..."
                 )
-                new_arr = np.full(
+                new_arr = da.full(
                     existing_shape,
-                    new_var.attrs["_FillValue"] if "_FillValue" in new_var.attrs else np.nan,
+                    attrs.pop("_FillValue", np.nan),
                     dtype=new_var.dtype,
+                    chunks=fill_chunks,
                 )
-                if "_FillValue" in new_var.attrs:
-                    new_var.attrs.pop("_FillValue")
                 ds_to_append[var_name] = xr.Variable(
                     dims=new_var.dims,
                     data=new_arr,
-                    attrs=new_var.attrs,
+                    attrs=attrs,
                     encoding=new_var.encoding,
-                ).chunk(existing_chunks)
+                )
     return ds_to_append
 
 
+def _zarr_generation(store) -> int:
+    """Commit generation of the published metadata, 0 if never committed"""
+    meta = store.get(".zmetadata")
+    if meta is None:
+        return 0
+    return json.loads(meta).get("commit_generation", 0)
+
+
+def _write_zmetadata(store, metadata: dict, generation: int, time_index=None):
+    meta = {
+        "zarr_consolidated_format": 1,
+        "metadata": metadata,
+        "commit_generation": generation,
+        "committed_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    if time_index is not None:
+        meta[TIME_INDEX_KEY] = time_index
+    store[".zmetadata"] = json.dumps(meta, indent=4, sort_keys=True).encode("ascii")
+
+
+# set on metadata put back over a rewrite that failed part way
+REFRESH_INCOMPLETE_KEY = "refresh_incomplete"
+
+
+def _restore_zmetadata(store, published: Optional[bytes]):
+    """
+    Put back metadata taken down for a rewrite that failed part way.
+
+    The chunks below it are a mix of the old and the new store, so the
+    restored metadata is flagged and appends to the store are refused
+    until a refresh rewrites it in full.
+    """
+    if published is None:
+        return
+    meta = json.loads(published)
+    meta[REFRESH_INCOMPLETE_KEY] = True
+    store[".zmetadata"] = json.dumps(meta, indent=4, sort_keys=True).encode("ascii")
+
+
+def _check_refresh_complete(store):
+    """
+    Raise ``IncompleteRefreshError`` when a refresh of ``store`` didn't
+    finish: its metadata is flagged by ``_restore_zmetadata``, or the
+    group is there with no published metadata at all.
+    """
+    meta = store.get(".zmetadata")
+    if meta is None:
+        incomplete = store.get(".zgroup") is not None
+    else:
+        incomplete = json.loads(meta).get(REFRESH_INCOMPLETE_KEY, False)
+    if incomplete:
+        raise IncompleteRefreshError(
+            f"A refresh of {store.root} didn't complete, its chunks may be from two "
+            "different stores. Re-launch this stream with refresh=True."
+        )
+
+
+def _commit_zarr(store, changed_keys=None, time_index=None, generation=None) -> int:
+    """
+    Publish the array metadata of a write done with ``consolidated=False``.
+
+    Chunks and per-array ``.zarray`` files land first. Readers going
+    through the consolidated ``.zmetadata`` keep seeing the previous
+    shapes until it is replaced, in a single PUT, by the new metadata
+    stamped with the next commit generation.
+
+    Parameters
+    ----------
+    store : MutableMapping
+        The zarr store to commit
+    changed_keys : list, optional
+        Metadata keys written since the last commit. Only these are read
+        back and patched into the published ``.zmetadata``, instead of
+        listing the store and reading every metadata key.
+    time_index : dict, optional
+        Time index to publish along, see ``data_vent.utils.time_index``.
+        Incremental commits keep the published one otherwise, full ones
+        drop it since the time array may have changed in any way.
+    generation : int, optional
+        Generation to publish, the one after the published metadata by
+        default. For stores whose metadata was taken down while rewritten.
+
+    Returns
+    -------
+    int
+        The generation that was published.
+    """
+    published = store.get(".zmetadata")
+    published = {} if published is None else json.loads(published)
+    if changed_keys is None or not published:
+        metadata = {
+            key: json.loads(store[key])
+            for key in store
+            if key.endswith((".zarray", ".zgroup", ".zattrs"))
+        }
+    else:
+        metadata = published["metadata"]
+        for key in changed_keys:
+            metadata[key] = json.loads(store[key])
+        if time_index is None:
+            time_index = published.get(TIME_INDEX_KEY)
+    if generation is None:
+        generation = published.get("commit_generation", 0) + 1
+    _write_zmetadata(store, metadata, generation, time_index=time_index)
+    return generation
+
+
+# most keys a single S3 DeleteObjects request takes
+DELETE_BATCH = 1000
+
+
+async def _gather_bounded(coros, concurrency):
+    """Await ``coros`` with at most ``concurrency`` of them in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(bounded(c) for c in coros))
+
+
+def _store_keys(store, concurrency=32) -> set:
+    """
+    Keys of an fsspec mapper, listed afresh. On async filesystems like S3
+    the group level is listed first and every array prefix below it is
+    then listed on its own, ``concurrency`` of them at a time, instead of
+    paging through the whole store in a single listing.
+    """
+    fs = store.fs
+    root = store.root.rstrip("/")
+    fs.invalidate_cache(root)
+    if not isinstance(fs, AsyncFileSystem):
+        return {path[len(root) + 1 :] for path in fs.find(root)}
+
+    async def list_store():
+        try:
+            entries = await fs._ls(root, detail=True)
+        except FileNotFoundError:
+            return []
+        paths = [e["name"] for e in entries if e["type"] != "directory"]
+        prefixes = [e["name"] for e in entries if e["type"] == "directory"]
+        listings = await _gather_bounded([fs._find(p) for p in prefixes], concurrency)
+        return paths + [path for listing in listings for path in listing]
+
+    return {path[len(root) + 1 :] for path in sync(fs.loop, list_store)}
+
+
+def _delete_keys(store, keys, concurrency=32):
+    """
+    Delete ``keys`` from an fsspec mapper. On async filesystems like S3
+    they go out in requests of ``DELETE_BATCH`` keys, ``concurrency`` of
+    them at a time.
+    """
+    if not keys:
+        return
+    fs = store.fs
+    if not isinstance(fs, AsyncFileSystem):
+        store.delitems(sorted(keys))
+        return
+    root = store.root.rstrip("/")
+    paths = [f"{root}/{key}" for key in sorted(keys)]
+    batches = [paths[i : i + DELETE_BATCH] for i in range(0, len(paths), DELETE_BATCH)]
+    sync(fs.loop, _gather_bounded, [fs._rm(batch) for batch in batches], concurrency)
+    fs.invalidate_cache(root)
+
+
+def _clear_store(store, concurrency=32):
+    """Delete every object of an fsspec mapper"""
+    if isinstance(store.fs, AsyncFileSystem):
+        _delete_keys(store, _store_keys(store, concurrency), concurrency)
+        return
+    root = store.root.rstrip("/")
+    if store.fs.exists(root):
+        store.fs.rm(root, recursive=True)
+
+
+def _copy_zarr_store(source, target, excludes=(), batch_size=32) -> set:
+    """
+    Copy every object of ``source`` into ``target``, replacing existing
+    ones. When both mappers share an async filesystem, e.g. two S3 buckets
+    under the same credentials, objects are copied server side with
+    ``batch_size`` concurrent requests and never go through this machine.
+    Anything else is copied key by key with ``zarr.copy_store``.
+
+    Parameters
+    ----------
+    source, target : fsspec.mapping.FSMap
+        The zarr stores to copy from and to
+    excludes : sequence of str
+        Regular expressions of keys not to copy
+    batch_size : int
+        Maximum number of copies, or prefix listings, in flight
+
+    Returns
+    -------
+    set
+        Every key of ``source``, excluded ones included.
+    """
+    if not (isinstance(source.fs, AsyncFileSystem) and source.fs is target.fs):
+        keys = set(source)
+        zarr.copy_store(source, target, excludes=list(excludes), if_exists="replace")
+        return keys
+
+    keys = _store_keys(source, batch_size)
+    to_copy = sorted(k for k in keys if not any(re.match(e, k) for e in excludes))
+    source_root, target_root = source.root.rstrip("/"), target.root.rstrip("/")
+    target.fs.copy(
+        [f"{source_root}/{k}" for k in to_copy],
+        [f"{target_root}/{k}" for k in to_copy],
+        batch_size=batch_size,
+    )
+    return keys
+
+
 def _append_zarr(store, ds_to_append, append_dim="time", consolidated=True):
     existing_zarr = zarr.open_group(store, mode="a")
 
@@ -204,15 +591,35 @@ def _append_zarr(store, ds_to_append, append_dim="time", consolidated=True):
         zarr.consolidate_metadata(store)
 
 
-def _download(source_url: str, cache_location: str) -> str:
+def _download(
+    source_url: str,
+    cache_location: str,
+    block_size: str = "8MB",
+    progress_interval: float = 30,
+    target_name: Optional[str] = None,
+    storage_options: Optional[dict] = None,
+) -> str:
     """
     Download a remote file to a cache.
+
+    The file is streamed in ``block_size`` pieces so peak memory does not
+    depend on the file size, and written under a ``.part`` name that is only
+    renamed once the copy completes.
+
     Parameters
     ----------
     source_url : str
         Path or url to the source file.
     cache_location : str
         Path or url to the target location for the source file.
+    block_size : str
+        Size of each read from the source, e.g. "8MB".
+    progress_interval : float
+        Seconds between progress and throughput log messages.
+    target_name : str, optional
+        File name to use in the cache, defaults to the source file name.
+    storage_options : dict, optional
+        fsspec options for opening the source, e.g. S3 credentials.
     Returns
     -------
     target_url : str
@@ -220,16 +627,210 @@ def _download(source_url: str, cache_location: str) -> str:
     """
     fs = fsspec.get_mapper(cache_location).fs
 
-    target_url = os.path.join(cache_location, os.path.basename(source_url))
+    target_url = os.path.join(cache_location, target_name or os.path.basename(source_url))
 
     # there is probably a better way to do caching!
-    try:
-        fs.open(target_url)
+    if fs.exists(target_url):
         return target_url
-    except FileNotFoundError:
-        pass
 
-    with fsspec.open(source_url, mode="rb") as source:
-        with fs.open(target_url, mode="wb") as target:
-            target.write(source.read())
+    if isinstance(block_size, str):
+        block_size = dask.utils.parse_bytes(block_size)
+
+    part_url = f"{target_url}.part"
+    name = os.path.basename(source_url)
+    copied = 0
+    start = last_report = time.monotonic()
+    try:
+        with fsspec.open(
+            source_url, mode="rb", block_size=block_size, **(storage_options or {})
+        ) as source:
+            total = getattr(source, "size", None)
+            with fs.open(part_url, mode="wb") as target:
+                while True:
+                    block = source.read(block_size)
+                    if not block:
+                        break
+                    target.write(block)
+                    copied += len(block)
+
+                    now = time.monotonic()
+                    if now - last_report >= progress_interval:
+                        last_report = now
+                        progress = dask.utils.memory_repr(copied)
+                        if total:
+                            progress += f" / {dask.utils.memory_repr(total)}"
+                        rate = dask.utils.memory_repr(copied / (now - start))
+                        logger.info(f"Downloading {name}: {progress} ({rate}/s)")
+    except BaseException:
+        # don't leave a partial file behind for the next attempt
+        if fs.exists(part_url):
+            fs.rm(part_url)
+        raise
+    fs.mv(part_url, target_url)
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    logger.info(
+        f"Downloaded {name}: {dask.utils.memory_repr(copied)} in {elapsed:.1f}s "
+        f"({dask.utils.memory_repr(copied / elapsed)}/s)"
+    )
     return target_url
+
+
+def _download_to_memory(source_url: str, block_size: str = "8MB") -> bytes:
+    """
+    Read a remote file straight into memory, in ``block_size`` pieces.
+    The pieces go into a ``BytesIO``, whose value is handed back as bytes
+    without copying the whole file once more.
+    """
+    if isinstance(block_size, str):
+        block_size = dask.utils.parse_bytes(block_size)
+
+    buffer = io.BytesIO()
+    start = time.monotonic()
+    with fsspec.open(source_url, mode="rb", block_size=block_size) as source:
+        while True:
+            block = source.read(block_size)
+            if not block:
+                break
+            buffer.write(block)
+    data = buffer.getvalue()
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    logger.info(
+        f"Fetched {os.path.basename(source_url)} into memory: "
+        f"{dask.utils.memory_repr(len(data))} in {elapsed:.1f}s"
+    )
+    return data
+
+
+def _open_netcdf(source, name: str = "inmemory.nc") -> xr.Dataset:
+    """
+    Open a netcdf file without decoding times, either from a local
+    path or from the raw bytes of the file held in memory.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        import netCDF4
+
+        # netCDF4 never releases the buffer of a dataset that isn't closed,
+        # which breaks mutable buffers; bytes are used as they are
+        nc = netCDF4.Dataset(name, mode="r", memory=bytes(source))
+        return xr.open_dataset(xr.backends.NetCDF4DataStore(nc), decode_times=False)
+    return xr.open_dataset(source, engine="netcdf4", decode_times=False)
+
+
+def _prefetch_downloads(
+    datasets: list,
+    async_url: str,
+    download_location: str,
+    prefetch: int = 1,
+    max_bytes: str = "2GB",
+    block_size: str = "8MB",
+    cache=None,
+    in_memory_max_bytes: Optional[str] = None,
+):
+    """
+    Download netcdf files ahead of processing in a background thread pool.
+
+    Files are yielded in the order of ``datasets`` so appends still commit
+    in ``start_ts`` order. Up to ``prefetch`` files are downloaded while the
+    current one is processed, as long as the total bytes of downloaded but
+    unprocessed files stay under ``max_bytes``. A single file larger than
+    ``max_bytes`` is still fetched, just without any prefetching around it.
+    Each file downloaded into ``download_location`` is removed once the
+    consumer moves on to the next one; files served from a local ``cache``
+    are left in place. Files no larger than ``in_memory_max_bytes`` skip
+    the disk entirely and are yielded as raw bytes for ``_open_netcdf``.
+
+    Parameters
+    ----------
+    datasets : list
+        Dataset dictionaries from the thredds catalog, with ``name``
+        and ``size_bytes`` keys.
+    async_url : str
+        Url of the async results folder holding the netcdf files.
+    download_location : str
+        Local folder to download the files into.
+    prefetch : int
+        Number of files to download ahead of the current one.
+    max_bytes : str
+        Cap on in-flight bytes, e.g. "2GB".
+    block_size : str
+        Read size used to stream each file to disk.
+    cache : NetcdfCache, optional
+        Persistent cache to fetch the files through.
+    in_memory_max_bytes : str, optional
+        Size threshold under which files are kept in memory, None
+        always downloads to ``download_location``.
+
+    Yields
+    ------
+    tuple
+        The dataset dictionary and either the local path or the bytes
+        of its netcdf file.
+    """
+    max_bytes = dask.utils.parse_bytes(max_bytes)
+    in_memory_bytes = -1
+    if in_memory_max_bytes:
+        in_memory_bytes = dask.utils.parse_bytes(in_memory_max_bytes)
+    pending = collections.deque()
+    state = {"next": 0, "inflight": 0, "holding": False}
+
+    def _submit(executor):
+        while state["next"] < len(datasets):
+            d = datasets[state["next"]]
+            size = int(d.get("size_bytes", 0))
+            idle = len(pending) == 0 and not state["holding"]
+            within_cap = (
+                len(pending) < prefetch and state["inflight"] + size <= max_bytes
+            )
+            if not (idle or within_cap):
+                break
+            source_url = "/".join([async_url, d.get("name")])
+            in_memory = 0 < size <= in_memory_bytes
+            if cache is not None:
+                future = executor.submit(
+                    cache.fetch,
+                    d,
+                    source_url,
+                    download_location,
+                    block_size=block_size,
+                    in_memory=in_memory,
+                )
+            elif in_memory:
+                future = executor.submit(
+                    _download_to_memory, source_url, block_size=block_size
+                )
+            else:
+                future = executor.submit(
+                    _download,
+                    source_url=source_url,
+                    cache_location=download_location,
+                    block_size=block_size,
+                )
+            pending.append((d, size, future))
+            state["inflight"] += size
+            state["next"] += 1
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(prefetch, 1))
+    try:
+        _submit(executor)
+        while pending:
+            d, size, future = pending.popleft()
+            nc_source = future.result()
+            state["holding"] = True
+            # Queue up the next downloads while this file is being processed
+            _submit(executor)
+            try:
+                yield d, nc_source
+            finally:
+                state["inflight"] -= size
+                state["holding"] = False
+                if (
+                    isinstance(nc_source, str)
+                    and os.path.dirname(nc_source) == download_location
+                ):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(nc_source)
+            _submit(executor)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -46,6 +46,98 @@ class HarvestRange(BaseModel):
             )
 
 
+class ProcessingOptions(BaseModel):
+    # number of netcdf files downloaded ahead of the one being processed
+    prefetch: int = 1
+    # cap on bytes downloaded but not yet processed, including the current file
+    prefetch_max_bytes: str = "2GB"
+    # read size when streaming a netcdf file to disk
+    download_block_size: str = "8MB"
+    # files up to this size are decoded from memory without touching disk,
+    # None always goes through the temp directory
+    in_memory_max_bytes: Optional[str] = "256MB"
+    # local folder or s3 url (e.g. under HARVEST_CACHE_BUCKET) where downloaded
+    # netcdf files are kept across task retries, None disables the cache
+    cache_location: Optional[str] = None
+    # least recently used files are evicted over this total size
+    cache_max_bytes: str = "50GB"
+    # consecutive compatible files are concatenated along time up to this
+    # in-memory size and appended to zarr in one go, None appends file by file
+    coalesce_max_bytes: Optional[str] = "256MB"
+
+    # concurrent chunk writes to zarr, 1 keeps the single-threaded scheduler
+    # for memory constrained streams
+    write_concurrency: int = 1
+    # worker processes for refresh, each deployment is written to its own
+    # store and merged in time order afterwards, 1 processes files in series
+    refresh_workers: int = 1
+    # files over this size are opened lazily and written in time windows of
+    # slice_chunks target chunks to bound memory, e.g. "2GB". None, the
+    # default, loads whole files
+    slice_min_bytes: Optional[str] = None
+    slice_chunks: int = 4
+    # record committed netcdf files in the flow process bucket so a retried
+    # data_processing skips them, only used when processing files in series
+    journal: bool = False
+    # publish the consolidated metadata once at the end of data_processing
+    # instead of after every append, readers see no new data until then
+    defer_commit: bool = False
+    # daily appends go into a small-chunk tail store next to the final store,
+    # whole chunk spans are compacted into the final store when finalizing.
+    # Up to a span of the latest samples is only in the tail store, readers of
+    # the final store alone should go through open_tail_dataset
+    tail_store: bool = False
+    tail_max_chunk: str = "4MB"
+    # concurrent S3 requests when a refresh replaces the final store or
+    # deployment stores are merged: object copies, listings of array prefixes
+    # and deletes of up to 1000 keys each
+    copy_concurrency: int = 32
+    # stored (compressed) size aimed at for each chunk of a new store, measured
+    # on the first file; None sizes chunks from uncompressed bytes only
+    chunk_target: Optional[str] = None
+    # pick compressor and filters per variable of a new store by trial encoding
+    # the first file, scored by transfer time at codec_bandwidth per second
+    # plus codec time, so lower bandwidths favor compression ratio
+    codec_tuning: bool = False
+    codec_bandwidth: str = "100MB"
+    # store the time of new stores as delta encoded int64 at this resolution
+    # instead of float64 seconds, appends follow the store they go into
+    time_resolution: Optional[Literal["s", "ms", "us"]] = None
+    # downcast and bit round the parameters of new stores following
+    # config.PRECISION_POLICY, precision_verify logs the largest error of each
+    precision_policy: bool = False
+    precision_verify: bool = False
+    # keep a copy of the store next to it, rechunked with rechunker into long
+    # time series of single bins or wavelengths for analysis; it is extended
+    # after every finalize, rebuilt on refresh. replica_chunk is the
+    # uncompressed size of its chunks, replica_max_mem the memory budget.
+    # Every extension rewrites the last, partial chunk of each bin, up to
+    # replica_chunk each; accepted to keep the replica as recent as the store
+    analysis_replica: bool = False
+    replica_chunk: str = "50MB"
+    replica_max_mem: str = "1GB"
+    # refresh stores are created at their final time length from the netcdf
+    # headers and each file is written into its own region, files that
+    # overlap in time fall back to appends
+    presize_refresh: bool = False
+
+    @field_validator("prefetch")
+    @classmethod
+    def prefetch_not_negative(cls, v):
+        if v < 0:
+            raise ValueError("prefetch cannot be negative")
+        return v
+
+    @field_validator(
+        "write_concurrency", "refresh_workers", "slice_chunks", "copy_concurrency"
+    )
+    @classmethod
+    def at_least_one(cls, v, info):
+        if v < 1:
+            raise ValueError(f"{info.field_name} must be at least 1")
+        return v
+
+
 class HarvestOptions(BaseModel):
     path: str
     force_harvest: bool = False
@@ -55,6 +147,7 @@ class HarvestOptions(BaseModel):
     goldcopy: bool = False
     path_settings: dict = {}
     custom_range: HarvestRange = HarvestRange()
+    processing: ProcessingOptions = ProcessingOptions()
 
     @field_validator("path")
     @classmethod
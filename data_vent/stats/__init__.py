@@ -14,6 +14,7 @@ from xarray.coding.times import decode_cf_datetime
 from data_vent.config import DATA_BUCKET
 from data_vent.utils.compute import map_concurrency
 from data_vent.settings.main import harvest_settings
+from data_vent.utils.time_index import read_time_index
 
 
 FS = fsspec.filesystem("s3", **harvest_settings.storage_options.aws.model_dump())
@@ -40,31 +41,53 @@ def is_valid(inst, instrument_refs=[]):
 
 
 def create_stream_dct(data_stream):
+    from data_vent.processor.tail import _tail_zarr
+
     try:
         fmap = FS.get_mapper(data_stream["zarr_file"])
         zg = zarr.open_consolidated(fmap)
         stream_id = data_stream["zarr_file"].split("/")[-1]
 
+        # the latest data sits in the tail store when there is one
+        tail_map = FS.get_mapper(_tail_zarr(data_stream["zarr_file"]))
+        tail_zg = None
+        if tail_map.get(".zmetadata") is not None:
+            tail_zg = zarr.open_consolidated(tail_map)
+
         # Get variables, data products, and sizes
-        variables = [
-            dict(
-                name=k,
-                size=memory_repr(arr.nbytes),
-                bytes_size=arr.nbytes,
-                product_id=arr.attrs.get("data_product_identifier"),
+        variables = []
+        for k, arr in zg.arrays():
+            nbytes = arr.nbytes
+            if tail_zg is not None and k in tail_zg:
+                nbytes += tail_zg[k].nbytes
+            variables.append(
+                dict(
+                    name=k,
+                    size=memory_repr(nbytes),
+                    bytes_size=nbytes,
+                    product_id=arr.attrs.get("data_product_identifier"),
+                )
             )
-            for k, arr in zg.arrays()
-        ]
         data_products = [v["name"] for v in variables if v["product_id"] is not None]
         total_size = sum(v["bytes_size"] for v in variables)
         tsize_string = memory_repr(total_size)
 
-        # Get date range
+        # Get date range, from the time index when the store has one
         time_arr = zg["time"]
         units = time_arr.attrs.get("units", "seconds since 1900-01-01")
         calendar = time_arr.attrs.get("calendar", "gregorian")
+        time_index = read_time_index(fmap)
+        if time_index is not None:
+            time_range = [time_index["start"], time_index["end"]]
+        else:
+            time_range = [time_arr[0], time_arr[-1]]
+        if tail_zg is not None and tail_zg["time"].shape[0] > 0:
+            tail_index = read_time_index(tail_map)
+            time_range[1] = (
+                tail_index["end"] if tail_index is not None else tail_zg["time"][-1]
+            )
         date_range = decode_cf_datetime(
-            np.array([time_arr[0], time_arr[-1]]),
+            np.array(time_range),
             units=units,
             calendar=calendar,
         )
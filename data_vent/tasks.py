@@ -1,9 +1,11 @@
 import datetime
+import concurrent.futures
+import multiprocessing
+import math
 from typing import Any, Dict
 import xarray as xr
 import dask
 import json
-import time
 import tempfile
 import dateutil
 import fsspec
@@ -22,17 +24,49 @@ from data_vent.producer import (
     perform_request,
 )
 from data_vent.processor import (
-    _download,
     _update_time_coverage,
     update_metadata,
     chunk_ds,
     append_to_zarr,
-    is_zarr_ready,
     preproc,
     reindex_to_max_coordinates,
+    _trim_overlap,
+    _merge_zarr_stores,
+    _write_scheduler,
+    _time_window,
+    _commit_zarr,
+    _copy_zarr_store,
+    _clear_store,
+    is_zarr_ready,
+    ZarrStoreState,
 )
+from data_vent.processor.cache import NetcdfCache
+from data_vent.processor.journal import IngestJournal
+from data_vent.processor.region import plan_regions, write_region, _resize_time
+from data_vent.processor.tail import (
+    _tail_zarr,
+    init_tail_store,
+    compact_tail_store,
+    recover_tail_store,
+    open_tail_dataset,
+    _staged_tail,
+)
+from data_vent.processor.replica import _replica_zarr, update_replica
 from data_vent.processor.checker import check_in_progress
-from data_vent.processor.utils import _write_data_avail, _get_var_encoding
+from data_vent.processor.utils import (
+    _write_data_avail,
+    _get_var_encoding,
+    _restore_zmetadata,
+    _check_refresh_complete,
+    _can_coalesce,
+    _prefetch_downloads,
+    _open_netcdf,
+    _convert_time,
+    _time_units,
+    _zarr_generation,
+    _store_keys,
+    _delete_keys,
+)
 from data_vent.processor.pipeline import _fetch_avail_dict
 
 from data_vent.utils.parser import (
@@ -46,9 +80,16 @@ from data_vent.utils.validate import (
     check_for_empty_qartod_vars
 )
 from data_vent.utils.conn import get_s3_kwargs, check_zarr
+from data_vent.utils.time_index import (
+    build_time_index,
+    read_time_index,
+    update_time_index,
+    time_chunk_offset,
+)
 from data_vent.settings import harvest_settings
 from data_vent.config import FLOW_PROCESS_BUCKET
 from data_vent.config import STORAGE_OPTIONS
+from data_vent.config import PRECISION_POLICY
 from data_vent.exceptions import (
     DataNotReadyError,
     NullMetadataError,
@@ -72,6 +113,17 @@ def setup_status_s3fs(
     return fs, status_file
 
 
+def setup_ingest_journal(stream_harvest: StreamHarvest, target_zarr: str) -> IngestJournal:
+    fs, _ = setup_status_s3fs(stream_harvest)
+    journal_file = f"{FLOW_PROCESS_BUCKET}/harvest-journal/{stream_harvest.table_name}"
+    return IngestJournal(
+        fs,
+        journal_file,
+        data_response=stream_harvest.status.data_response,
+        target=target_zarr,
+    )
+
+
 def write_status_json(
     stream_harvest: StreamHarvest,
 ):
@@ -524,6 +576,521 @@ def setup_process(response_json, target_bucket):
     return nc_files_dict
 
 
+def _process_datasets(
+    datasets,
+    nc_files_dict,
+    stream_harvest,
+    target_zarr,
+    existing_enc,
+    max_chunk,
+    refresh,
+    overwrite_attrs,
+    check_qartod,
+    is_new_store,
+    logger,
+    journal=None,
+):
+    """
+    Download, preprocess and write netcdf files to ``target_zarr`` in the
+    order given. When ``is_new_store`` is set the first file (re)creates
+    the store, otherwise every file is appended to it.
+
+    With an ``IngestJournal``, files committed by a previous attempt are
+    skipped and anything appended after the last of them is rolled back.
+
+    With ``processing.presize_refresh`` on a refresh, the store is created
+    at its final time length from the file headers and every file is
+    written into its own region instead of appended.
+    """
+    name = nc_files_dict.get("stream").get("table_name")
+    target_store = fsspec.get_mapper(
+        target_zarr,
+        **stream_harvest.harvest_options.path_settings,
+    )
+    processing = stream_harvest.harvest_options.processing
+    coalesce_bytes = 0
+    if processing.coalesce_max_bytes:
+        coalesce_bytes = dask.utils.parse_bytes(processing.coalesce_max_bytes)
+    slice_bytes = None
+    if processing.slice_min_bytes:
+        slice_bytes = dask.utils.parse_bytes(processing.slice_min_bytes)
+    # codecs are only tuned when a store is (re)created
+    codec_bandwidth = processing.codec_bandwidth if processing.codec_tuning else None
+    precision_policy = PRECISION_POLICY if processing.precision_policy else None
+
+    # Consecutive compatible datasets waiting to be appended in one go
+    batch = []
+    batch_datasets = []
+    # Schema of the target store shared by every append of this run
+    store_state = None
+
+    def _store_state():
+        nonlocal store_state
+        if store_state is None:
+            store_state = ZarrStoreState(target_store)
+        return store_state
+
+    def _append_batch():
+        if len(batch) == 1:
+            batch_ds = batch[0]
+        else:
+            logger.info(f"Coalescing {len(batch)} datasets into a single append.")
+            batch_ds = xr.concat(
+                batch,
+                dim="time",
+                data_vars="minimal",
+                coords="minimal",
+                compat="override",
+                combine_attrs="override",
+            )
+            # attributes as appending the files one by one leaves them: the
+            # group gets the last file's, variables keep the first file's
+            # unless they are overwritten on every append
+            batch_ds.attrs = dict(batch[-1].attrs)
+            if overwrite_attrs:
+                for var_name, var in batch[-1].variables.items():
+                    batch_ds[var_name].attrs = dict(var.attrs)
+        mod_ds, enc = chunk_ds(
+            batch_ds,
+            max_chunk=max_chunk,
+            existing_enc=existing_enc,
+            apply=False,
+        )
+        logger.info("Finished chunking dataset.")
+        succeed = append_to_zarr(
+            mod_ds,
+            target_store,
+            enc,
+            overwrite_attrs,
+            logger=logger,
+            write_concurrency=processing.write_concurrency,
+            state=_store_state(),
+            commit=not processing.defer_commit,
+        )
+        if succeed:
+            logger.info(
+                f"SUCCESS: {len(batch)} file(s) successfully written to zarr."
+            )
+        else:
+            batch_names = [b.get("name") for b in batch_datasets]
+            logger.warning(f"SKIPPED: Issues in file found for {','.join(batch_names)}!")
+        if journal is not None:
+            journal.commit(batch_datasets, _store_state(), skipped=not succeed)
+        batch.clear()
+        batch_datasets.clear()
+
+    def _write_dataset(ds, is_first, dataset, region=None):
+        # dataset is None for all but the last time window of a file,
+        # so a file only counts as committed once all of it is in zarr
+        nonlocal store_state
+        # Chunk dataset and write to zarr
+        if is_first:
+            mod_ds, enc = chunk_ds(
+                ds,
+                max_chunk=max_chunk,
+                existing_enc=existing_enc,
+                apply=True,
+                target_chunk=processing.chunk_target,
+                codec_bandwidth=codec_bandwidth,
+                precision_policy=precision_policy,
+                verify_precision=processing.precision_verify,
+            )
+            logger.info("Finished chunking dataset.")
+            with _write_scheduler(processing.write_concurrency):
+                mod_ds.to_zarr(
+                    target_store,
+                    consolidated=False,
+                    compute=True,
+                    mode="w",
+                    encoding=enc,
+                    write_empty_chunks=False,
+                )
+            time_index = None
+            if regions is not None:
+                # the rest of the files go into regions past this one
+                _resize_time(target_store, region_length)
+            elif "chunks" in enc.get("time", {}):
+                time_index = build_time_index(mod_ds["time"].values, enc["time"]["chunks"][0])
+            _commit_zarr(target_store, time_index=time_index)
+            # the store was just rewritten, read its schema afresh
+            store_state = None
+            logger.info("SUCCESS: File successfully written to zarr.")
+            if journal is not None and dataset is not None:
+                journal.commit([dataset], _store_state())
+            return
+
+        if region is not None:
+            mod_ds, enc = chunk_ds(
+                ds,
+                max_chunk=max_chunk,
+                existing_enc=existing_enc,
+                apply=False,
+            )
+            write_region(
+                mod_ds,
+                target_store,
+                enc,
+                region,
+                overwrite_attrs,
+                logger=logger,
+                write_concurrency=processing.write_concurrency,
+                state=_store_state(),
+                commit=not processing.defer_commit,
+            )
+            logger.info("SUCCESS: File successfully written to zarr.")
+            if journal is not None and dataset is not None:
+                journal.commit([dataset], _store_state())
+            return
+
+        # only files below coalesce_max_bytes are held in memory for a
+        # batch, larger ones are appended lazily on their own
+        small = ds.nbytes < coalesce_bytes
+        if batch:
+            batch_bytes = sum(b.nbytes for b in batch)
+            if (
+                not small
+                or not _can_coalesce(batch[-1], ds)
+                or batch_bytes + ds.nbytes > coalesce_bytes
+            ):
+                _append_batch()
+            else:
+                # same overlap trim append_to_zarr does against the store
+                ds, _ = _trim_overlap(ds, batch[-1]["time"].data[-1])
+
+        if small:
+            # the netcdf file is removed once the next one is yielded
+            ds = ds.load()
+        batch.append(ds)
+        if dataset is not None:
+            batch_datasets.append(dataset)
+        if not small:
+            _append_batch()
+
+    def _region(dataset, start, length):
+        # time slice of part of a file in a pre-sized store
+        if regions is None:
+            return None
+        offset = regions[dataset.get("name")][0] + start
+        return (offset, offset + length)
+
+    def _stop_regions(dataset, is_first, reason):
+        # files before this one filled the store up to its region, cut
+        # the store there and append this file and the rest
+        nonlocal regions, store_state
+        offset = regions[dataset.get("name")][0]
+        logger.warning(f"{reason}, appending from sample {offset} on.")
+        regions = None
+        if not is_first:
+            _resize_time(target_store, offset)
+            _commit_zarr(target_store)
+            store_state = None
+
+    nc_cache = None
+    if processing.cache_location:
+        nc_cache = NetcdfCache(
+            f"{processing.cache_location.rstrip('/')}/{name}",
+            max_bytes=processing.cache_max_bytes,
+            storage_options=stream_harvest.harvest_options.path_settings,
+        )
+
+    regions = None
+    if refresh and processing.presize_refresh:
+        regions = plan_regions(datasets, nc_files_dict.get("async_url"), logger=logger)
+    if regions is not None:
+        region_length = max([stop for _, stop in regions.values()], default=0)
+        datasets = [d for d in datasets if d.get("name") in regions]
+        logger.info(f"Writing {len(datasets)} files into a store of {region_length} samples.")
+
+    if journal is not None and journal.lengths is not None:
+        if not is_zarr_ready(target_store):
+            logger.warning("Ingest journal has no matching zarr store, starting over.")
+            journal.reset()
+        elif journal.rollback(target_store):
+            logger.warning("Rolled back data appended by the previous attempt.")
+    if journal is not None and journal.committed:
+        committed = [d for d in datasets if journal.is_committed(d.get("name"))]
+        datasets = [d for d in datasets if not journal.is_committed(d.get("name"))]
+        logger.info(f"Resuming after {len(committed)} files committed by a previous attempt.")
+        # the store was already created by the previous attempt
+        is_new_store = False
+        if regions is not None and ZarrStoreState(target_store).shapes["time"] != (
+            region_length,
+        ):
+            # the previous attempt appended, keep appending
+            regions = None
+    if journal is not None and not is_new_store and is_zarr_ready(target_store):
+        # lengths to roll back to should this attempt fail before a commit
+        journal.begin(_store_state())
+
+    # new stores keep time at processing.time_resolution, appends follow
+    # whatever the store holds
+    time_units = None
+    if is_new_store:
+        if processing.time_resolution is not None:
+            time_units = _time_units(processing.time_resolution)
+    elif is_zarr_ready(target_store):
+        store_time = zarr.open_consolidated(target_store)["time"]
+        if np.issubdtype(store_time.dtype, np.integer):
+            time_units = store_time.attrs["units"]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Download the netcdf files in the background while the
+        # previous ones are processed, still yielded in start_ts order
+        downloads = _prefetch_downloads(
+            datasets,
+            nc_files_dict.get("async_url"),
+            tmpdir,
+            prefetch=processing.prefetch,
+            max_bytes=processing.prefetch_max_bytes,
+            block_size=processing.download_block_size,
+            cache=nc_cache,
+            in_memory_max_bytes=processing.in_memory_max_bytes,
+        )
+        with dask.config.set(scheduler="single-threaded"):
+            for idx, (d, nc_source) in enumerate(downloads):
+                # Only the first file of a new store creates it,
+                # everything else (and daily runs) appends
+                is_first = idx == 0 and is_new_store
+
+                logger.info(
+                    f"*** {name} ({d.get('deployment')}) | {d.get('start_ts')} - {d.get('end_ts')} ***"
+                )
+                if isinstance(nc_source, str):
+                    logger.info(f"Downloaded: {nc_source}")
+                else:
+                    logger.info(f"Fetched into memory: {d.get('name')}")
+                ds = (
+                    _open_netcdf(nc_source, name=d.get("name"))
+                    .pipe(preproc)
+                    .pipe(
+                        update_metadata,
+                        nc_files_dict.get("retrieved_dt"),
+                    )
+                )
+                if time_units is not None:
+                    ds, time_error = _convert_time(ds, time_units)
+                    if time_error > 0:
+                        logger.warning(
+                            f"Rounded time to {time_units.split(' since ')[0]}, "
+                            f"losing up to {time_error:.3g}s."
+                        )
+                # <<< SOME DATA VALIDATION depending on context >>>
+                # only check for duplicate timestamps during daily appends
+                if not refresh:
+                    check_for_timestamp_duplicates(ds, logger=logger)
+                if refresh and check_qartod:
+                    ds = check_for_empty_qartod_vars(ds, logger=logger)
+
+                logger.info("Finished preprocessing dataset.")
+
+                window = None
+                if slice_bytes and d.get("size_bytes", 0) > slice_bytes:
+                    # Keep the file lazy so reindexing and chunking
+                    # only ever materialize one time window
+                    _, enc = chunk_ds(
+                        ds,
+                        max_chunk=max_chunk,
+                        existing_enc=existing_enc,
+                        apply=False,
+                    )
+                    window = _time_window(ds, enc, processing.slice_chunks)
+                    ds = ds.chunk({"time": window})
+
+                ds = reindex_to_max_coordinates(ds, stream_harvest.instrument, logger)
+
+                if not isinstance(ds, xr.Dataset):
+                    logger.warning("SKIPPED: Failed pre processing!")
+                    if regions is not None:
+                        _stop_regions(d, is_first, "A planned file was skipped")
+                    continue
+
+                if regions is not None:
+                    planned = regions[d.get("name")][1] - regions[d.get("name")][0]
+                    if ds.sizes["time"] != planned:
+                        _stop_regions(
+                            d,
+                            is_first,
+                            f"{d.get('name')} has {ds.sizes['time']} samples, "
+                            f"{planned} were planned",
+                        )
+
+                if window is None or window >= ds.sizes["time"]:
+                    _write_dataset(ds, is_first, d, _region(d, 0, ds.sizes["time"]))
+                    continue
+
+                n_windows = math.ceil(ds.sizes["time"] / window)
+                logger.info(
+                    f"Writing {d.get('name')} in {n_windows} time windows "
+                    f"of {window} samples."
+                )
+                if batch:
+                    _append_batch()
+                for i, start in enumerate(range(0, ds.sizes["time"], window)):
+                    logger.info(f"Time window {i + 1}/{n_windows}")
+                    window_ds = ds.isel(time=slice(start, start + window))
+                    is_last = start + window >= ds.sizes["time"]
+                    _write_dataset(
+                        window_ds,
+                        is_first and i == 0,
+                        d if is_last else None,
+                        _region(d, start, window_ds.sizes["time"]),
+                    )
+                    if batch:
+                        _append_batch()
+
+            if batch:
+                _append_batch()
+
+    if regions is not None and is_zarr_ready(target_store):
+        # regions don't maintain the time index, index the whole store once
+        generation = _commit_zarr(
+            target_store,
+            time_index=update_time_index(zarr.open_group(target_store, mode="r")["time"]),
+        )
+        logger.info(f"Committed zarr generation {generation}.")
+    elif processing.defer_commit and store_state is not None:
+        generation = store_state.commit()
+        logger.info(f"Committed zarr generation {generation}.")
+
+
+def _deployment_zarr(temp_zarr, deployment):
+    """Intermediate store of a single deployment during a parallel refresh"""
+    return f"{temp_zarr.rstrip('/').removesuffix('.zarr')}__deployment{deployment:04d}.zarr"
+
+
+def _deployments_are_sequential(dataset_list):
+    """
+    True when the files span more than one deployment and the deployments
+    follow each other in time without overlapping, so their stores can be
+    merged one after the other.
+    """
+    spans = {}
+    for d in dataset_list:
+        start, end = spans.get(d.get("deployment"), (d.get("start_ts"), d.get("end_ts")))
+        spans[d.get("deployment")] = (min(start, d.get("start_ts")), max(end, d.get("end_ts")))
+    ordered = sorted(spans.values())
+    if len(ordered) < 2:
+        return False
+    return all(prev[1] <= nxt[0] for prev, nxt in zip(ordered, ordered[1:]))
+
+
+def _worker_harvest(stream_harvest, workers):
+    """
+    Copy of ``stream_harvest`` for one of ``workers`` processes running at
+    once, with the memory budgets of its processing options split evenly.
+    """
+    processing = stream_harvest.harvest_options.processing
+    budgets = {}
+    for field in ("prefetch_max_bytes", "in_memory_max_bytes", "coalesce_max_bytes"):
+        value = getattr(processing, field)
+        if value:
+            budgets[field] = str(dask.utils.parse_bytes(value) // workers)
+    worker_harvest = stream_harvest.model_copy(deep=True)
+    worker_harvest.harvest_options.processing = processing.model_copy(update=budgets)
+    return worker_harvest
+
+
+def _process_deployment(
+    deployment,
+    datasets,
+    nc_files_dict,
+    stream_harvest,
+    temp_zarr,
+    max_chunk,
+    overwrite_attrs,
+    check_qartod,
+):
+    """Worker process entry point: write one deployment to its own store"""
+    from loguru import logger
+
+    deployment_zarr = _deployment_zarr(temp_zarr, deployment)
+    logger.info(f"Processing deployment {deployment} into {deployment_zarr}")
+    _process_datasets(
+        datasets,
+        nc_files_dict,
+        stream_harvest,
+        deployment_zarr,
+        None,
+        max_chunk,
+        True,
+        overwrite_attrs,
+        check_qartod,
+        is_new_store=True,
+        logger=logger,
+    )
+    return deployment_zarr
+
+
+def _process_deployments(
+    dataset_list,
+    nc_files_dict,
+    stream_harvest,
+    temp_zarr,
+    max_chunk,
+    overwrite_attrs,
+    check_qartod,
+    logger,
+):
+    """
+    Refresh a stream by processing each deployment into its own
+    intermediate store in parallel worker processes, then merging the
+    stores into ``temp_zarr`` in time order.
+    """
+    processing = stream_harvest.harvest_options.processing
+    by_deployment = {}
+    for d in dataset_list:
+        by_deployment.setdefault(d.get("deployment"), []).append(d)
+    # dataset_list is sorted by start_ts so this is the time order
+    deployments = list(by_deployment)
+    logger.info(
+        f"Processing {len(deployments)} deployments with "
+        f"{processing.refresh_workers} worker processes."
+    )
+
+    workers = min(processing.refresh_workers, len(deployments))
+    # workers run side by side, each gets its share of the memory budgets
+    worker_harvest = _worker_harvest(stream_harvest, workers)
+    path_settings = stream_harvest.harvest_options.path_settings
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=ctx
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _process_deployment,
+                    deployment,
+                    by_deployment[deployment],
+                    nc_files_dict,
+                    worker_harvest,
+                    temp_zarr,
+                    max_chunk,
+                    overwrite_attrs,
+                    check_qartod,
+                )
+                for deployment in deployments
+            ]
+            deployment_zarrs = [f.result() for f in futures]
+
+        _merge_zarr_stores(
+            deployment_zarrs,
+            temp_zarr,
+            path_settings,
+            max_chunk,
+            overwrite_attrs,
+            write_concurrency=processing.write_concurrency,
+            batch_size=processing.copy_concurrency,
+            logger=logger,
+        )
+    finally:
+        # merged stores are already gone, these are left by failed workers
+        for deployment in deployments:
+            deployment_store = fsspec.get_mapper(
+                _deployment_zarr(temp_zarr, deployment), **path_settings
+            )
+            _clear_store(deployment_store, processing.copy_concurrency)
+
+
 @task
 def data_processing(
     nc_files_dict, 
@@ -557,10 +1124,6 @@ def data_processing(
     update_and_write_status(stream_harvest, status_json)
     dataset_list = sorted(nc_files_dict.get("datasets", []), key=lambda i: i.get("start_ts"))
     temp_zarr = nc_files_dict.get("temp_bucket")
-    temp_store = fsspec.get_mapper(
-        temp_zarr,
-        **stream_harvest.harvest_options.path_settings,
-    )
 
     existing_enc = None
     if not stream_harvest.harvest_options.refresh:
@@ -569,97 +1132,65 @@ def data_processing(
             final_zarr,
             **stream_harvest.harvest_options.path_settings,
         )
-        zg = zarr.open_consolidated(final_store)
-        existing_enc = {k: _get_var_encoding(var) for k, var in zg.arrays()}
+        # a refresh that failed part way left chunks of two stores behind
+        _check_refresh_complete(final_store)
         # change "temp" to the actual final when daily append
         temp_zarr = final_zarr
-        temp_store = final_store
+        processing = stream_harvest.harvest_options.processing
+        if processing.tail_store:
+            # or to its tail store, split off the final store when missing
+            tail_store = fsspec.get_mapper(
+                _tail_zarr(final_zarr),
+                **stream_harvest.harvest_options.path_settings,
+            )
+            recover_tail_store(tail_store, logger=logger)
+            if is_zarr_ready(tail_store) or init_tail_store(
+                final_store,
+                tail_store,
+                max_chunk=processing.tail_max_chunk,
+                logger=logger,
+            ):
+                temp_zarr = _tail_zarr(final_zarr)
+                final_store = tail_store
+        zg = zarr.open_consolidated(final_store)
+        existing_enc = {k: _get_var_encoding(var) for k, var in zg.arrays()}
 
     if len(dataset_list) > 0:
-        for idx, d in enumerate(dataset_list):
-            is_first = False
-            if idx == 0:
-                if stream_harvest.harvest_options.refresh:
-                    # Append to live data when it's daily
-                    # So it's never the first
-                    is_first = True
-              
-            logger.info(
-                f"*** {name} ({d.get('deployment')}) | {d.get('start_ts')} - {d.get('end_ts')} ***"
+        processing = stream_harvest.harvest_options.processing
+        if (
+            stream_harvest.harvest_options.refresh
+            and processing.refresh_workers > 1
+            and _deployments_are_sequential(dataset_list)
+        ):
+            _process_deployments(
+                dataset_list,
+                nc_files_dict,
+                stream_harvest,
+                temp_zarr,
+                max_chunk,
+                overwrite_attrs,
+                check_qartod,
+                logger,
+            )
+        else:
+            journal = None
+            if processing.journal:
+                journal = setup_ingest_journal(stream_harvest, temp_zarr)
+            _process_datasets(
+                dataset_list,
+                nc_files_dict,
+                stream_harvest,
+                temp_zarr,
+                existing_enc,
+                max_chunk,
+                refresh,
+                overwrite_attrs,
+                check_qartod,
+                # Append to live data when it's daily
+                is_new_store=stream_harvest.harvest_options.refresh,
+                logger=logger,
+                journal=journal,
             )
-            with tempfile.TemporaryDirectory() as tmpdir:
-                source_url = "/".join([nc_files_dict.get("async_url"), d.get("name")])
-                # Download the netcdf files and read to a xarray dataset obj
-                ncpath = _download(
-                    source_url=source_url,
-                    cache_location=tmpdir,
-                )
-                logger.info(f"Downloaded: {ncpath}")
-                with dask.config.set(scheduler="single-threaded"):
-                    ds = (
-                        xr.open_dataset(ncpath, engine="netcdf4", decode_times=False)
-                        .pipe(preproc)
-                        .pipe(
-                            update_metadata,
-                            nc_files_dict.get("retrieved_dt"),
-                        )
-                    )
-                    # <<< SOME DATA VALIDATION depending on context >>>
-                    # only check for duplicate timestamps during daily appends
-                    if not refresh:
-                        check_for_timestamp_duplicates(ds)
-                    if refresh and check_qartod:
-                        ds = check_for_empty_qartod_vars(ds)
-
-                    logger.info("Finished preprocessing dataset.")
-
-                    ds = reindex_to_max_coordinates(ds, stream_harvest.instrument, logger)
-
-                    # Chunk dataset and write to zarr
-                    if isinstance(ds, xr.Dataset):
-                        mod_ds, enc = chunk_ds(
-                            ds,
-                            max_chunk=max_chunk,
-                            existing_enc=existing_enc,
-                            apply=is_first,
-                        )
-                        logger.info("Finished chunking dataset.")
-
-                        if is_first:
-                            # TODO: Like the _prepare_ds_to_append need to check on the dims and len for all variables
-                            mod_ds.to_zarr(
-                                temp_store,
-                                consolidated=True,
-                                compute=True,
-                                mode="w",
-                                encoding=enc,
-                            )
-                            succeed = True
-                        else:
-                            succeed = append_to_zarr(
-                                mod_ds, temp_store, enc, overwrite_attrs, logger=logger #TODO see what temp store and store are and how to impliment them for custom qartod
-                            )
-
-                        if succeed:
-                            is_done = False
-                            while not is_done:
-                                store = fsspec.get_mapper(
-                                    temp_zarr,
-                                    **stream_harvest.harvest_options.path_settings,
-                                )
-                                is_done = is_zarr_ready(store)
-                                if is_done:
-                                    continue
-                                time.sleep(5)
-                                logger.info("Waiting for zarr file writing to finish...")
-                            logger.info("SUCCESS: File successfully written to zarr.")
-                        else:
-                            logger.warning(
-                                f"SKIPPED: Issues in file found for {d.get('name')}!"
-                            )
-                    else:
-                        logger.warning("SKIPPED: Failed pre processing!")
-
     else:
         raise MissingDataError("No datasets to process. Skipping...")
     return {
@@ -683,22 +1214,64 @@ def finalize_data_stream(stores_dict, stream_harvest, max_chunk):
             stores_dict.get("temp_path"),
             **stream_harvest.harvest_options.path_settings,
         )
+        tail_store = fsspec.get_mapper(
+            _tail_zarr(final_path),
+            **stream_harvest.harvest_options.path_settings,
+        )
+        processing = stream_harvest.harvest_options.processing
         if stream_harvest.harvest_options.refresh:
             # Refresh must be a true replace of the final store, not a merge.
             # copy_store only overwrites colliding keys, so chunks from a
             # previous chunk grid (e.g. a changed wavelength size) or removed
             # variables would otherwise survive and corrupt later appends.
-            stale_keys = set(final_store) - set(temp_store)
-
-            # Copy over the store, at this point, they should be similar
-            zarr.copy_store(temp_store, final_store, if_exists="replace")
+            final_keys = _store_keys(final_store, processing.copy_concurrency)
+
+            # Take the published metadata down first, readers must not see
+            # it over the new chunks. Until _update_time_coverage republishes
+            # it under the next generation, the store reads as not ready.
+            # Should the copy fail, it's put back flagged as incomplete so
+            # that daily appends refuse the store until it's refreshed again.
+            next_generation = _zarr_generation(final_store) + 1
+            published = final_store.pop(".zmetadata", None)
+
+            try:
+                # Copy over the store, at this point, they should be similar.
+                # The consolidated metadata is left out and republished by
+                # _update_time_coverage once every chunk has landed.
+                temp_keys = _copy_zarr_store(
+                    temp_store,
+                    final_store,
+                    excludes=[r"^\.zmetadata$"],
+                    batch_size=processing.copy_concurrency,
+                )
+                stale_keys = final_keys - temp_keys
 
-            if stale_keys:
-                logger.warning(
-                    f"Removing {len(stale_keys)} stale keys from final store "
-                    "left over from a previous store layout."
+                if stale_keys:
+                    logger.warning(
+                        f"Removing {len(stale_keys)} stale keys from final store "
+                        "left over from a previous store layout."
+                    )
+                    _delete_keys(final_store, stale_keys, processing.copy_concurrency)
+            except Exception:
+                logger.error(f"Refresh of {final_path} failed part way, flagging it.")
+                _restore_zmetadata(final_store, published)
+                raise
+            # the refreshed store already holds everything the tail had
+            _clear_store(tail_store)
+            _clear_store(_staged_tail(tail_store))
+        else:
+            recover_tail_store(tail_store, logger=logger)
+            if is_zarr_ready(tail_store):
+                # fold whole chunk spans into the final store, or everything
+                # when the tail layout was switched off for this stream
+                compact_tail_store(
+                    final_store,
+                    tail_store,
+                    max_chunk=max_chunk,
+                    tail_max_chunk=processing.tail_max_chunk,
+                    full=not processing.tail_store,
+                    logger=logger,
                 )
-                final_store.delitems(list(stale_keys))
         # NOTE: Comment out since append to live data happened during
         # data_processing task
         # else:
@@ -735,13 +1308,27 @@ def finalize_data_stream(stores_dict, stream_harvest, max_chunk):
         #         update_and_write_status(stream_harvest, status_json)
         #         raise FAIL(f"Issues in file found for {final_path}!")
 
-        # Update start and end date in global attributes
-        start_dt, end_dt = _update_time_coverage(final_store)
+        # Update start and end date in global attributes. A refresh copied
+        # a whole new store, daily appends only changed the attributes
+        if stream_harvest.harvest_options.refresh:
+            start_dt, end_dt = _update_time_coverage(
+                final_store,
+                tail_store=tail_store,
+                time_index=read_time_index(temp_store),
+                generation=next_generation,
+            )
+        else:
+            start_dt, end_dt = _update_time_coverage(
+                final_store, changed_keys=[], tail_store=tail_store
+            )
 
         if stream_harvest.harvest_options.refresh:
             # Clean up temp_store
             # no temp store was created during daily append
-            temp_store.clear()
+            _clear_store(temp_store, processing.copy_concurrency)
+        if processing.journal:
+            # the ingest is complete, a new run must not resume from it
+            setup_ingest_journal(stream_harvest, stores_dict.get("temp_path")).clear()
         logger.info(f"Data stream finalized: {final_path}")
         status_json.update(
             {
@@ -773,6 +1360,30 @@ def finalize_data_stream(stores_dict, stream_harvest, max_chunk):
         raise Failed(message=exc_dict.get("traceback", str(e)), result=exc_dict)
 
 
+@task
+def update_analysis_replica(final_path, stream_harvest):
+    """
+    Bring the analysis replica of a finalized store up to date. It follows
+    the main store only, samples still in a tail store join at compaction.
+    """
+    logger = get_run_logger()
+    logger.info("=== Updating analysis replica. ===")
+    path_settings = stream_harvest.harvest_options.path_settings
+    processing = stream_harvest.harvest_options.processing
+    replica_path = _replica_zarr(final_path)
+    update_replica(
+        fsspec.get_mapper(final_path, **path_settings),
+        fsspec.get_mapper(replica_path, **path_settings),
+        fsspec.get_mapper(f"{replica_path}__rechunk", **path_settings),
+        chunk_size=processing.replica_chunk,
+        max_mem=processing.replica_max_mem,
+        rebuild=stream_harvest.harvest_options.refresh,
+        logger=logger,
+    )
+    logger.info(f"Analysis replica updated: {replica_path}")
+    return replica_path
+
+
 @task
 def data_availability(nc_files_dict, stream_harvest, export=False, gh_write=False):
     name = nc_files_dict["stream"]["table_name"]
@@ -789,12 +1400,23 @@ def data_availability(nc_files_dict, stream_harvest, export=False, gh_write=Fals
         za = zarr.open_consolidated(mapper)["time"]
         calendar = za.attrs.get("calendar", harvest_settings.ooi_config.time["calendar"])
         units = za.attrs.get("units", harvest_settings.ooi_config.time["units"])
+        darr = da.from_zarr(za)
 
-        if any(np.isnan(za)):
+        # the latest data sits in the tail store when there is one
+        tail_mapper = fsspec.get_mapper(
+            _tail_zarr(url), **stream_harvest.harvest_options.path_settings
+        )
+        if is_zarr_ready(tail_mapper):
+            tail_time = zarr.open_consolidated(tail_mapper)["time"][:]
+            if za.shape[0] > 0:
+                # samples of an interrupted compaction can be in both stores
+                tail_time = tail_time[tail_time > za[-1]]
+            darr = da.concatenate([darr, da.from_array(tail_time)])
+
+        if da.isnan(darr).any().compute():
             logger.info(f"Null values found. Skipping {name}")
         else:
-            logger.info(f"Total time bytes: {dask.utils.memory_repr(za.nbytes)}")
-            darr = da.from_zarr(za)
+            logger.info(f"Total time bytes: {dask.utils.memory_repr(darr.nbytes)}")
 
             darr_dt = darr.map_blocks(
                 xr.coding.times.decode_cf_datetime,
@@ -858,7 +1480,9 @@ def run_advanced_qaqc(stream_harvest, nc_files_dict, refresh):
         logger.info(f"Zarr end date: {zarr_end_date}")
         logger.info("New data found since last advanced QAQC. Running advanced QAQC...")
 
-        ds = xr.open_zarr(final_store, consolidated=True, chunks="auto")
+        ds = open_tail_dataset(
+            nc_files_dict.get("final_bucket"), fs_kwargs, consolidated=True, chunks="auto"
+        )
 
         if mode == "w":
             ds_to_qaqc = ds
@@ -868,7 +1492,27 @@ def run_advanced_qaqc(stream_harvest, nc_files_dict, refresh):
             # dateutil at microsecond precision while decoded zarr times carry
             # nanosecond residue, which re-included the boundary point and
             # appended one duplicate timestamp per run.
-            last_flag_time = xr.open_zarr(qaqc_store, consolidated=True).time[-1].values
+            qaqc_time = zarr.open_consolidated(qaqc_store)["time"]
+            qaqc_index = read_time_index(qaqc_store)
+            if qaqc_index is not None:
+                last_flag_time = xr.coding.times.decode_cf_datetime(
+                    [qaqc_index["end"]],
+                    units=qaqc_time.attrs.get("units"),
+                    calendar=qaqc_time.attrs.get("calendar", "gregorian"),
+                )[0]
+            else:
+                last_flag_time = xr.open_zarr(qaqc_store, consolidated=True).time[-1].values
+
+            final_index = read_time_index(final_store)
+            if final_index is not None:
+                # skip the chunks entirely before the cutoff without reading them
+                final_time = zarr.open_consolidated(final_store)["time"]
+                cutoff, _, _ = xr.coding.times.encode_cf_datetime(
+                    np.array([last_flag_time]),
+                    units=final_time.attrs.get("units", "seconds since 1900-01-01 0:0:0"),
+                    calendar=final_time.attrs.get("calendar", "gregorian"),
+                )
+                ds = ds.isel(time=slice(time_chunk_offset(final_index, cutoff[0]), None))
             ds_to_qaqc = ds.isel(time=(ds.time > last_flag_time).values)
 
         if ds_to_qaqc.time.size == 0:
@@ -884,12 +1528,27 @@ def run_advanced_qaqc(stream_harvest, nc_files_dict, refresh):
             qaqc_store,
             mode=mode,
             append_dim="time" if mode == "a" else None,
-            consolidated=True,
+            consolidated=False,
             align_chunks=True,
         )
-        zarr.convenience.consolidate_metadata(qaqc_store)
 
-        _, new_advanced_qaqc_end_date = _update_time_coverage(qaqc_store) # NOTE alternate way to get date range
+        # only the samples just written are read to extend the time index
+        qaqc_index = update_time_index(
+            zarr.open_group(qaqc_store, mode="r")["time"],
+            None if mode == "w" else read_time_index(qaqc_store),
+        )
+        changed_keys = None
+        if mode == "a":
+            # only the arrays written by the append are read back and published
+            changed_keys = [
+                f"{name}/{key}"
+                for name in advanced_qaqc_ds.variables
+                for key in (".zarray", ".zattrs")
+            ]
+        # NOTE alternate way to get date range
+        _, new_advanced_qaqc_end_date = _update_time_coverage(
+            qaqc_store, changed_keys=changed_keys, time_index=qaqc_index
+        )
 
         # update qaqc metadata in status json on s3
         status_json.update({"advanced_qaqc_end_date": new_advanced_qaqc_end_date})
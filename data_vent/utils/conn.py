@@ -16,6 +16,7 @@ from data_vent.utils.parser import (
     parse_param_dict,
 )
 from data_vent.settings.main import harvest_settings
+from data_vent.utils.time_index import read_time_index
 
 DEFAULT_TIMEOUT = 5  # seconds
 
@@ -49,17 +50,26 @@ SESSION.mount("https://", timeout_adapter)
 
 
 def check_zarr(dest_fold, storage_options={}):
+    from data_vent.processor.tail import _tail_zarr
+
     fsmap = fsspec.get_mapper(dest_fold, **storage_options)
     if fsmap.get(".zmetadata") is not None:
         zgroup = zarr.open_consolidated(fsmap)
         if "time" not in zgroup:
             raise ValueError(f"Dimension time is missing from the dataset {dest_fold}!")
 
-        time_array = zgroup["time"]
+        time_array, time_map = zgroup["time"], fsmap
+        # the latest data sits in the tail store when there is one
+        tail_map = fsspec.get_mapper(_tail_zarr(dest_fold), **storage_options)
+        if tail_map.get(".zmetadata") is not None:
+            time_map = tail_map
+            time_array = zarr.open_consolidated(tail_map)["time"]
         calendar = time_array.attrs.get("calendar", "gregorian")
         units = time_array.attrs.get("units", "seconds since 1900-01-01 0:0:0")
+        time_index = read_time_index(time_map)
+        last_value = time_index["end"] if time_index is not None else time_array[-1]
         last_time = xr.coding.times.decode_cf_datetime(
-            [time_array[-1]], units=units, calendar=calendar
+            [last_value], units=units, calendar=calendar
         )
         return True, last_time[0]
     else:
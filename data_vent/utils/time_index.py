@@ -0,0 +1,118 @@
+import json
+from typing import Optional
+
+import numpy as np
+
+# Key of the time index in the consolidated ``.zmetadata`` of a store. It is
+# published together with the array metadata, so it always describes the
+# same time array readers see.
+TIME_INDEX_KEY = "time_index"
+
+
+def build_time_index(times, chunk: int, index: Optional[dict] = None) -> dict:
+    """
+    Summarize time values per zarr chunk: min, max and count of every
+    chunk, plus the first and last value and the total length.
+
+    Parameters
+    ----------
+    times : array-like
+        Raw (encoded) time values
+    chunk : int
+        Chunk length of the time array
+    index : dict, optional
+        Index of the samples ``times`` are appended after, it is extended
+        in place. A new index is started when not given.
+
+    Returns
+    -------
+    dict
+        The time index
+    """
+    # values keep their type, integer time must not pick up float noise
+    times = np.asarray(times)
+    if index is None:
+        index = {"chunk": int(chunk), "length": 0, "start": None, "end": None, "chunks": []}
+    if times.size == 0:
+        return index
+
+    chunk = index["chunk"]
+    length = index["length"]
+    offset = 0
+    while offset < times.size:
+        partial = length % chunk
+        part = times[offset : offset + chunk - partial]
+        lo, hi = part.min().item(), part.max().item()
+        if partial:
+            last = index["chunks"][-1]
+            index["chunks"][-1] = [min(last[0], lo), max(last[1], hi), last[2] + part.size]
+        else:
+            index["chunks"].append([lo, hi, part.size])
+        offset += part.size
+        length += part.size
+
+    if index["start"] is None:
+        index["start"] = times[0].item()
+    index["end"] = times[-1].item()
+    index["length"] = length
+    return index
+
+
+def update_time_index(time_array, index: Optional[dict] = None) -> dict:
+    """
+    Bring ``index`` up to date with the zarr ``time_array``, only reading
+    the samples past the ones it already covers. The whole array is read
+    when there is no index yet.
+    """
+    if index is None:
+        return build_time_index(time_array[:], time_array.chunks[0])
+    return build_time_index(time_array[index["length"] :], index["chunk"], index)
+
+
+def truncate_time_index(time_array, index: dict, length: int) -> dict:
+    """
+    Index of the first ``length`` samples of the zarr ``time_array`` that
+    ``index`` describes. Only the chunk the cut falls into is read.
+    """
+    chunk = index["chunk"]
+    kept = (max(length - 1, 0) // chunk) * chunk
+    truncated = {
+        "chunk": chunk,
+        "length": kept,
+        "start": index["start"] if kept else None,
+        "end": None,
+        "chunks": [list(c) for c in index["chunks"][: kept // chunk]],
+    }
+    return build_time_index(time_array[kept:length], chunk, truncated)
+
+
+def get_time_index(zmetadata: dict) -> Optional[dict]:
+    """
+    Time index of a parsed ``.zmetadata``, or None when there is none or
+    it does not match the published time array.
+    """
+    index = zmetadata.get(TIME_INDEX_KEY)
+    time_meta = zmetadata.get("metadata", {}).get("time/.zarray")
+    if index is None or time_meta is None:
+        return None
+    if index["length"] != time_meta["shape"][0] or index["chunk"] != time_meta["chunks"][0]:
+        return None
+    return index
+
+
+def read_time_index(store) -> Optional[dict]:
+    """Time index of a zarr store, from its consolidated metadata"""
+    zmetadata = store.get(".zmetadata")
+    if zmetadata is None:
+        return None
+    return get_time_index(json.loads(zmetadata))
+
+
+def time_chunk_offset(index: dict, value) -> int:
+    """
+    Position of the first chunk holding samples after ``value``, in the
+    same units as the index. Everything before it can be skipped without
+    reading any time values.
+    """
+    maxes = np.array([c[1] for c in index["chunks"]])
+    return int(np.searchsorted(maxes, value, side="right")) * index["chunk"]
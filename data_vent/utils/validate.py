@@ -11,8 +11,9 @@ from prefect import get_run_logger
 from data_vent.exceptions import DuplicateTimeStampError
 
 
-def check_for_timestamp_duplicates(ds: xr.DataArray) -> None:
-    logger = get_run_logger()
+def check_for_timestamp_duplicates(ds: xr.DataArray, logger=None) -> None:
+    if logger is None:
+        logger = get_run_logger()
 
     timestamps_sorted = np.sort(ds.time.values)
     duplicate_indices = np.where(timestamps_sorted[1:] == timestamps_sorted[:-1])[0]
@@ -29,8 +30,9 @@ def check_for_timestamp_duplicates(ds: xr.DataArray) -> None:
         logger.info("No duplicate timestamps found.")
 
 
-def check_for_empty_qartod_vars(ds: xr.DataArray) -> None:
-    logger = get_run_logger()
+def check_for_empty_qartod_vars(ds: xr.DataArray, logger=None) -> None:
+    if logger is None:
+        logger = get_run_logger()
     logger.info("Checking for empty strings in qartod variables")
 
     qartod_var_list = [var for var in ds.data_vars if "qartod" in var]
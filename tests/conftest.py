@@ -0,0 +1,73 @@
+import fsspec
+import numpy as np
+import pytest
+import xarray as xr
+
+TIME_UNITS = "seconds since 1900-01-01 0:0:0"
+
+
+def _make_ds(start, stop, bins=2, variables=("a", "b")):
+    time = np.arange(start, stop, dtype="float64")
+    data_vars = {}
+    for name in variables:
+        if name == "a":
+            data_vars[name] = ("time", time.copy())
+        else:
+            data_vars[name] = (("time", "bin"), np.repeat(time[:, None], bins, axis=1))
+    ds = xr.Dataset(
+        data_vars,
+        coords={
+            "time": ("time", time, {"units": TIME_UNITS}),
+            "bin": ("bin", np.arange(bins)),
+        },
+        attrs={"title": "test stream"},
+    )
+    for name in variables:
+        ds[name].encoding["_FillValue"] = np.nan
+    return ds
+
+
+@pytest.fixture
+def make_ds():
+    """
+    Undecoded datasets with one sample per second from ``start`` to
+    ``stop``. ``a`` is a time series, any other variable is binned, and
+    every value equals its time so positions can be checked after a write.
+    Data variables carry a NaN ``_FillValue``, like those of OOI files.
+    """
+    return _make_ds
+
+
+@pytest.fixture
+def store_factory(tmp_path):
+    """Local fsspec mappers under the temporary directory of the test"""
+
+    def factory(name="stream.zarr"):
+        return fsspec.get_mapper(str(tmp_path / name))
+
+    return factory
+
+
+@pytest.fixture
+def store(store_factory):
+    return store_factory()
+
+
+@pytest.fixture
+def create_store():
+    """Write a dataset as a new committed store, ``chunk`` samples per time chunk"""
+    from data_vent.processor import _commit_zarr
+    from data_vent.utils.time_index import build_time_index
+
+    def create(ds, store, chunk=10):
+        encoding = {
+            name: {
+                "chunks": tuple(chunk if d == "time" else s for d, s in var.sizes.items())
+            }
+            for name, var in ds.variables.items()
+            if "time" in var.dims
+        }
+        ds.to_zarr(store, mode="w", consolidated=False, encoding=encoding)
+        return _commit_zarr(store, time_index=build_time_index(ds["time"].values, chunk))
+
+    return create
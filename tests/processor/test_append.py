@@ -0,0 +1,60 @@
+import numpy as np
+import xarray as xr
+import zarr
+
+from data_vent.processor import ZarrStoreState, append_to_zarr, chunk_ds
+from data_vent.utils.time_index import build_time_index, read_time_index
+
+
+def _append(ds, store, state, **kwargs):
+    mod_ds, enc = chunk_ds(ds, apply=False)
+    return append_to_zarr(mod_ds, store, enc, False, state=state, **kwargs)
+
+
+def test_appends_share_one_state(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    state = ZarrStoreState(store)
+    for start in (25, 40, 55):
+        assert _append(make_ds(start, start + 15), store, state)
+
+    ds = xr.open_zarr(store, decode_times=False)
+    np.testing.assert_array_equal(ds.time.values, np.arange(70))
+    np.testing.assert_array_equal(ds.b.values[:, 1], np.arange(70))
+    # the cached schema matches the store as read from scratch
+    assert state.shapes == ZarrStoreState(store).shapes
+    assert read_time_index(store) == build_time_index(np.arange(70.0), 10)
+
+
+def test_deferred_commit(store, make_ds, create_store):
+    generation = create_store(make_ds(0, 25), store)
+    state = ZarrStoreState(store)
+    _append(make_ds(25, 40), store, state, commit=False)
+    _append(make_ds(40, 50), store, state, commit=False)
+    assert zarr.open_consolidated(store)["time"].shape == (25,)
+
+    assert state.commit() == generation + 1
+    assert zarr.open_consolidated(store)["time"].shape == (50,)
+    assert read_time_index(store)["end"] == 49.0
+
+
+def test_overlap_is_trimmed(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    state = ZarrStoreState(store)
+    _append(make_ds(20, 30), store, state)
+    times = xr.open_zarr(store, decode_times=False).time.values
+    np.testing.assert_array_equal(times, np.arange(30))
+
+
+def test_new_variable_is_filled_before_its_first_sample(store, make_ds, create_store):
+    create_store(make_ds(0, 25, variables=("a",)), store)
+    state = ZarrStoreState(store)
+    _append(make_ds(25, 40), store, state)
+    # and left out of the next file again
+    _append(make_ds(40, 45, variables=("a",)), store, state)
+
+    ds = xr.open_zarr(store, decode_times=False)
+    assert ds.b.shape == (45, 2)
+    assert np.isnan(ds.b.values[:25]).all()
+    np.testing.assert_array_equal(ds.b.values[25:40, 0], np.arange(25, 40))
+    assert np.isnan(ds.b.values[40:]).all()
+    assert state.shapes == ZarrStoreState(store).shapes
@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+from data_vent.processor.cache import NetcdfCache
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """Three 1KB source files and their thredds catalog entries"""
+    (tmp_path / "src").mkdir()
+    files = {}
+    for name in ("a.nc", "b.nc", "c.nc"):
+        path = tmp_path / "src" / name
+        path.write_bytes(os.urandom(1000))
+        files[name] = ({"name": name, "size_bytes": 1000, "date_modified": "1"}, str(path))
+    return files
+
+
+def _index(cache):
+    with open(cache.index_url) as f:
+        return json.load(f)
+
+
+def test_workers_keep_each_others_entries(tmp_path, sources):
+    location = str(tmp_path / "cache")
+    first, second = NetcdfCache(location), NetcdfCache(location)
+    first.fetch(*sources["a.nc"], str(tmp_path))
+    second.fetch(*sources["b.nc"], str(tmp_path))
+    names = {entry["name"] for entry in _index(first).values()}
+    assert names == {"a.nc", "b.nc"}
+
+
+def test_unindexed_files_are_evicted(tmp_path, sources):
+    location = str(tmp_path / "cache")
+    cache = NetcdfCache(location, max_bytes="2500B")
+    cache.fetch(*sources["a.nc"], str(tmp_path))
+    # written by a worker whose index write was lost
+    orphan = os.path.join(location, f"{NetcdfCache.cache_key(sources['b.nc'][0])}.nc")
+    with open(orphan, "wb") as f:
+        f.write(os.urandom(1000))
+    os.utime(orphan, (0, 0))
+
+    cache.fetch(*sources["c.nc"], str(tmp_path))
+    assert not os.path.exists(orphan)
+    assert {entry["name"] for entry in _index(cache).values()} == {"a.nc", "c.nc"}
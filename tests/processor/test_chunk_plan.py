@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from data_vent.processor import chunk_ds
+
+
+@pytest.fixture
+def mixed_ds():
+    """Variables compressing very differently, 4000 samples"""
+    rng = np.random.default_rng(0)
+    n = 4000
+    return xr.Dataset(
+        {
+            "flat": ("time", np.zeros(n)),
+            "noise": ("time", rng.standard_normal(n)),
+            "spectra": (("time", "wavelength"), rng.standard_normal((n, 8))),
+        },
+        coords={"time": ("time", np.arange(n, dtype="float64"))},
+    )
+
+
+def _time_chunks(ds, enc):
+    return {k: e["chunks"][ds[k].dims.index("time")] for k, e in enc.items()}
+
+
+def test_chunks_follow_compressed_size(mixed_ds):
+    _, enc = chunk_ds(mixed_ds, target_chunk="8KB", apply=False)
+    chunks = _time_chunks(mixed_ds, enc)
+    assert chunks["flat"] > chunks["noise"] > chunks["spectra"]
+
+
+def test_chunks_line_up(mixed_ds):
+    _, enc = chunk_ds(mixed_ds, target_chunk="8KB", apply=False)
+    chunks = _time_chunks(mixed_ds, enc)
+    base = min(chunks.values())
+    for length in chunks.values():
+        ratio = length / base
+        assert ratio == 2 ** int(math.log2(ratio))
+
+
+def test_uncompressed_size_is_capped(mixed_ds):
+    _, enc = chunk_ds(
+        mixed_ds, max_chunk="4KB", time_max_chunks="4KB", target_chunk="1MB", apply=False
+    )
+    for k, length in _time_chunks(mixed_ds, enc).items():
+        step = mixed_ds[k].nbytes // mixed_ds.sizes["time"]
+        assert length * step <= 4096
+
+
+def test_no_target_keeps_size_based_chunks(mixed_ds):
+    _, enc = chunk_ds(mixed_ds, max_chunk="8KB", apply=False)
+    assert _time_chunks(mixed_ds, enc)["flat"] == 1000
+
+
+def test_wide_steps_get_whole_chunks(store):
+    # under ten 160KB time steps fit in a compressed MB
+    rng = np.random.default_rng(0)
+    ds = xr.Dataset(
+        {"spectra": (("time", "wavelength"), rng.standard_normal((100, 20000)))},
+        coords={"time": ("time", np.arange(100, dtype="float64"))},
+    )
+    mod_ds, enc = chunk_ds(ds, target_chunk="1MB")
+    length = _time_chunks(ds, enc)["spectra"]
+    assert isinstance(length, int) and 1 <= length < 10
+    mod_ds.to_zarr(store, mode="w", encoding=enc)
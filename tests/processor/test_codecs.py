@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import xarray as xr
+from numcodecs import Delta
+
+from data_vent.processor import chunk_ds
+from data_vent.processor.codecs import CANDIDATE_COMPRESSORS, _encode, _sample
+
+
+@pytest.fixture
+def codec_ds():
+    rng = np.random.default_rng(0)
+    n = 5000
+    return xr.Dataset(
+        {
+            "counter": ("time", np.arange(n, dtype="int64") * 3),
+            "noise": ("time", rng.standard_normal(n)),
+            "label": ("time", np.array(["x"] * n)),
+        },
+        coords={"time": ("time", np.arange(n, dtype="int64") * 1000)},
+    )
+
+
+def test_tuned_encodings_round_trip(store, codec_ds):
+    mod_ds, enc = chunk_ds(codec_ds, codec_bandwidth="100MB")
+    mod_ds.to_zarr(store, mode="w", encoding=enc)
+    xr.testing.assert_identical(xr.open_zarr(store).load(), codec_ds)
+
+
+def test_low_bandwidth_picks_the_smallest_encoding(codec_ds):
+    # at a byte per second, codec speed doesn't count
+    _, enc = chunk_ds(codec_ds, apply=False, codec_bandwidth="1B")
+    sample = _sample(codec_ds["noise"])
+    smallest = min(len(_encode(sample, c)) for c in CANDIDATE_COMPRESSORS)
+    assert len(_encode(sample, enc["noise"]["compressor"])) == smallest
+
+
+def test_delta_only_for_monotonic_integers(codec_ds):
+    _, enc = chunk_ds(codec_ds, apply=False, codec_bandwidth="1KB")
+    assert any(isinstance(f, Delta) for f in enc["counter"].get("filters") or [])
+    assert not enc["noise"].get("filters")
+    # strings are left as they are
+    assert "filters" not in enc["label"]
+
+
+def test_existing_filters_are_kept(codec_ds):
+    _, enc = chunk_ds(codec_ds, apply=False, codec_bandwidth="1KB")
+    # integer time comes with a delta filter, tuning may only add to it
+    assert isinstance(enc["time"]["filters"][0], Delta)
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+import zarr
+
+from data_vent.exceptions import IncompleteRefreshError
+from data_vent.processor import _commit_zarr, _update_time_coverage, is_zarr_ready
+from data_vent.processor.utils import (
+    _check_refresh_complete,
+    _restore_zmetadata,
+    _zarr_generation,
+)
+from data_vent.utils.time_index import read_time_index
+
+
+def _published(store):
+    return json.loads(store[".zmetadata"])
+
+
+def test_commit_bumps_generation(store, make_ds, create_store):
+    assert _zarr_generation(store) == 0
+    assert create_store(make_ds(0, 25), store) == 1
+    assert _commit_zarr(store) == 2
+    assert _published(store)["commit_generation"] == 2
+    assert "committed_at" in _published(store)
+    assert _commit_zarr(store, generation=7) == 7
+    assert _zarr_generation(store) == 7
+
+
+def test_uncommitted_writes_are_invisible(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    zarr.open_group(store, mode="r+")["a"].resize(40)
+    assert zarr.open_consolidated(store)["a"].shape == (25,)
+    _commit_zarr(store, changed_keys=["a/.zarray"])
+    assert zarr.open_consolidated(store)["a"].shape == (40,)
+    # arrays not listed as changed keep their published metadata
+    assert zarr.open_consolidated(store)["b"].shape == (25, 2)
+
+
+def test_time_index_contents(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store, chunk=10)
+    index = read_time_index(store)
+    assert index["chunk"] == 10
+    assert index["length"] == 25
+    assert (index["start"], index["end"]) == (0.0, 24.0)
+    assert index["chunks"] == [[0.0, 9.0, 10], [10.0, 19.0, 10], [20.0, 24.0, 5]]
+
+
+def test_incremental_commit_keeps_time_index(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    index = read_time_index(store)
+    _commit_zarr(store, changed_keys=[".zattrs"])
+    assert read_time_index(store) == index
+
+
+def test_full_commit_drops_time_index(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    _commit_zarr(store)
+    assert read_time_index(store) is None
+
+
+def test_time_index_must_match_time_array(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    zarr.open_group(store, mode="r+")["time"].resize(30)
+    # published along a time array of another length, the index is ignored
+    _commit_zarr(store, changed_keys=["time/.zarray"])
+    assert read_time_index(store) is None
+
+
+def test_time_coverage_with_taken_down_metadata(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    generation = _zarr_generation(store) + 1
+    store.pop(".zmetadata")
+    assert not is_zarr_ready(store)
+    start, end = _update_time_coverage(store, generation=generation)
+    assert (start, end) == ("1900-01-01T00:00:00.000000000", "1900-01-01T00:00:24.000000000")
+    assert _zarr_generation(store) == generation
+    assert zarr.open_consolidated(store).attrs["time_coverage_end"] == end
+
+
+def test_failed_refresh_is_refused(store, make_ds, create_store):
+    create_store(make_ds(0, 25), store)
+    _check_refresh_complete(store)
+    published = store.pop(".zmetadata")
+    # the copy died with the metadata down
+    with pytest.raises(IncompleteRefreshError):
+        _check_refresh_complete(store)
+    _restore_zmetadata(store, published)
+    assert zarr.open_consolidated(store)["a"].shape == (25,)
+    with pytest.raises(IncompleteRefreshError):
+        _check_refresh_complete(store)
+    # a refresh that goes through publishes unflagged metadata
+    _commit_zarr(store, generation=_zarr_generation(store) + 1)
+    _check_refresh_complete(store)
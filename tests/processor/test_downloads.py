@@ -0,0 +1,119 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from data_vent.processor import utils
+from data_vent.processor.utils import (
+    _download,
+    _download_to_memory,
+    _open_netcdf,
+    _prefetch_downloads,
+)
+
+
+@pytest.fixture
+def nc_files(tmp_path):
+    """Three small netcdf files of 100 samples each, in time order"""
+    (tmp_path / "async").mkdir()
+    paths = []
+    for i in range(3):
+        time = np.arange(i * 100, (i + 1) * 100, dtype="float64")
+        ds = xr.Dataset(
+            {"a": ("time", time)},
+            coords={"time": ("time", time, {"units": "seconds since 1900-01-01"})},
+        )
+        path = tmp_path / "async" / f"deployment{i:04d}.nc"
+        ds.to_netcdf(path, engine="netcdf4")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def datasets(nc_files):
+    return [{"name": os.path.basename(p), "size_bytes": os.path.getsize(p)} for p in nc_files]
+
+
+@pytest.fixture
+def async_url(nc_files):
+    return os.path.dirname(nc_files[0])
+
+
+@pytest.fixture
+def download_location(tmp_path):
+    (tmp_path / "downloads").mkdir()
+    return str(tmp_path / "downloads")
+
+
+def test_files_are_yielded_in_order_and_removed(datasets, async_url, download_location):
+    starts = []
+    for d, nc_source in _prefetch_downloads(
+        datasets, async_url, download_location, prefetch=2
+    ):
+        assert os.path.dirname(nc_source) == download_location
+        with _open_netcdf(nc_source) as ds:
+            starts.append(int(ds.a[0]))
+        assert os.path.exists(nc_source)
+    assert starts == [0, 100, 200]
+    # each file is gone once the next one is taken
+    assert os.listdir(download_location) == []
+
+
+def test_prefetch_stays_under_the_byte_cap(
+    datasets, async_url, download_location, monkeypatch
+):
+    calls = []
+
+    def tracked(**kwargs):
+        calls.append(os.path.basename(kwargs["source_url"]))
+        return _download(**kwargs)
+
+    monkeypatch.setattr(utils, "_download", tracked)
+    # room for one file at a time only
+    max_bytes = f"{int(datasets[0]['size_bytes'] * 1.5)}B"
+    seen = []
+    for d, _ in _prefetch_downloads(
+        datasets, async_url, download_location, prefetch=2, max_bytes=max_bytes
+    ):
+        seen.append(len(calls))
+        assert calls[-1] == d["name"]
+    assert seen == [1, 2, 3]
+
+
+def test_small_files_stay_in_memory(datasets, async_url, download_location):
+    sources = [
+        nc_source
+        for _, nc_source in _prefetch_downloads(
+            datasets, async_url, download_location, in_memory_max_bytes="1MB"
+        )
+    ]
+    assert all(isinstance(s, bytes) for s in sources)
+    assert os.listdir(download_location) == []
+
+
+def test_open_from_memory(nc_files):
+    data = _download_to_memory(nc_files[1], block_size="1KB")
+    assert isinstance(data, bytes)
+    ds = _open_netcdf(data, name="deployment0001.nc")
+    np.testing.assert_array_equal(ds.a.values, np.arange(100, 200))
+    # times are left encoded
+    assert ds.time.dtype == np.float64
+    ds.close()
+
+
+def test_failed_download_leaves_no_part_file(nc_files, download_location, monkeypatch):
+    class Broken(io.BytesIO):
+        def read(self, size=-1):
+            if self.tell():
+                raise OSError("connection reset")
+            return super().read(size)
+
+    monkeypatch.setattr(
+        utils.fsspec, "open", lambda *args, **kwargs: contextlib.nullcontext(Broken(b"x" * 10))
+    )
+    with pytest.raises(OSError, match="connection reset"):
+        _download(nc_files[0], download_location, block_size=4)
+    assert os.listdir(download_location) == []
@@ -0,0 +1,101 @@
+import fsspec
+import pytest
+import xarray as xr
+import zarr
+
+from data_vent.processor import ZarrStoreState, append_to_zarr, chunk_ds
+from data_vent.processor.journal import IngestJournal
+
+
+@pytest.fixture
+def journal_factory(tmp_path):
+    def factory(data_response="request-1", target="stream.zarr"):
+        fs = fsspec.filesystem("file")
+        return IngestJournal(fs, str(tmp_path / "journal.json"), data_response, target)
+
+    return factory
+
+
+def _append(ds, store, state):
+    mod_ds, enc = chunk_ds(ds, apply=False)
+    append_to_zarr(mod_ds, store, enc, False, state=state)
+
+
+def _file(name, start, stop):
+    return {"name": name, "start_ts": start, "end_ts": stop}
+
+
+def test_rollback_to_last_commit(store, make_ds, create_store, journal_factory):
+    create_store(make_ds(0, 25), store)
+    journal = journal_factory()
+    state = ZarrStoreState(store)
+    journal.begin(state)
+    _append(make_ds(25, 40), store, state)
+    journal.commit([_file("one.nc", 25, 40)], state)
+    # appended but never recorded, the attempt died here
+    _append(make_ds(40, 50), store, state)
+
+    journal = journal_factory()
+    assert journal.is_committed("one.nc")
+    assert journal.committed["one.nc"]["samples"] == 15
+    assert journal.rollback(store)
+    assert zarr.open_consolidated(store)["b"].shape == (40, 2)
+    assert xr.open_zarr(store, decode_times=False).time.values[-1] == 39
+    assert not journal.rollback(store)
+
+
+def test_rollback_before_first_commit(store, make_ds, create_store, journal_factory):
+    create_store(make_ds(0, 25), store)
+    journal = journal_factory()
+    state = ZarrStoreState(store)
+    journal.begin(state)
+    _append(make_ds(25, 40), store, state)
+
+    journal = journal_factory()
+    assert journal.committed == {}
+    assert journal.rollback(store)
+    assert zarr.open_consolidated(store)["time"].shape == (25,)
+
+
+def test_rollback_removes_arrays_of_the_failed_attempt(
+    store, make_ds, create_store, journal_factory
+):
+    create_store(make_ds(0, 25, variables=("a",)), store)
+    journal = journal_factory()
+    state = ZarrStoreState(store)
+    journal.begin(state)
+    _append(make_ds(25, 40), store, state)
+
+    assert journal_factory().rollback(store)
+    group = zarr.open_consolidated(store)
+    assert "b" not in group
+    assert group["a"].shape == (25,)
+
+
+def test_coalesced_batch_is_recorded_on_its_first_file(
+    store, make_ds, create_store, journal_factory
+):
+    create_store(make_ds(0, 25), store)
+    journal = journal_factory()
+    state = ZarrStoreState(store)
+    journal.begin(state)
+    _append(make_ds(25, 40), store, state)
+    journal.commit([_file("one.nc", 25, 30), _file("two.nc", 30, 40)], state)
+    _append(make_ds(40, 45), store, state)
+    journal.commit([_file("three.nc", 40, 45)], state)
+
+    samples = {name: entry["samples"] for name, entry in journal.committed.items()}
+    assert samples == {"one.nc": 15, "two.nc": 0, "three.nc": 5}
+    assert journal.lengths == {"a": 45, "b": 45, "time": 45}
+
+
+def test_journal_of_another_request_is_ignored(
+    store, make_ds, create_store, journal_factory
+):
+    create_store(make_ds(0, 25), store)
+    journal = journal_factory()
+    journal.commit([_file("one.nc", 0, 25)], ZarrStoreState(store))
+
+    assert journal_factory().is_committed("one.nc")
+    assert not journal_factory(data_response="request-2").is_committed("one.nc")
+    assert not journal_factory(target="other.zarr").is_committed("one.nc")
@@ -0,0 +1,43 @@
+import numpy as np
+import xarray as xr
+import zarr
+
+from data_vent.processor import _merge_zarr_stores, is_zarr_ready
+from data_vent.utils.time_index import build_time_index, read_time_index
+
+
+def test_merge_in_order(tmp_path, store_factory, make_ds, create_store):
+    sources = [str(tmp_path / f"deployment_{i}.zarr") for i in range(4)]
+    create_store(make_ds(0, 25), store_factory("deployment_0.zarr"))
+    # nothing was written for the second deployment
+    create_store(make_ds(25, 40), store_factory("deployment_2.zarr"))
+    create_store(make_ds(40, 52), store_factory("deployment_3.zarr"))
+    # left over from an earlier merge, none of it may survive
+    create_store(make_ds(0, 100, variables=("a", "b", "c")), store_factory())
+
+    _merge_zarr_stores(sources, str(tmp_path / "stream.zarr"), {})
+
+    target = store_factory()
+    ds = xr.open_zarr(target, decode_times=False)
+    assert set(ds.data_vars) == {"a", "b"}
+    np.testing.assert_array_equal(ds.time.values, np.arange(52))
+    np.testing.assert_array_equal(ds.b.values[:, 0], np.arange(52))
+    assert read_time_index(target) == build_time_index(np.arange(52.0), 10)
+    # merged deployment stores are removed
+    assert not any((tmp_path / f"deployment_{i}.zarr").exists() for i in range(4))
+
+
+def test_merge_reconciles_variables(tmp_path, store_factory, make_ds, create_store):
+    sources = [str(tmp_path / "deployment_0.zarr"), str(tmp_path / "deployment_1.zarr")]
+    create_store(make_ds(0, 25, variables=("a",)), store_factory("deployment_0.zarr"))
+    create_store(make_ds(25, 40), store_factory("deployment_1.zarr"))
+
+    _merge_zarr_stores(sources, str(tmp_path / "stream.zarr"), {})
+
+    target = store_factory()
+    assert is_zarr_ready(target)
+    group = zarr.open_consolidated(target)
+    assert group["b"].shape == (40, 2)
+    b = xr.open_zarr(target, decode_times=False).b.values
+    assert np.isnan(b[:25]).all()
+    np.testing.assert_array_equal(b[25:, 1], np.arange(25, 40))
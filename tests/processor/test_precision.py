@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+import xarray as xr
+from numcodecs import BitRound
+
+from data_vent.processor import apply_precision_policy, chunk_ds
+
+POLICY = {
+    "*_qc_results": {"dtype": "uint8"},
+    "temperature": {"keepbits": 7},
+    "RD-SENSOR_L1": {"dtype": "float32"},
+}
+
+
+@pytest.fixture
+def precision_ds():
+    rng = np.random.default_rng(0)
+    n = 1000
+    return xr.Dataset(
+        {
+            "temp_qc_results": ("time", rng.integers(0, 256, n)),
+            "wide_qc_results": ("time", rng.integers(0, 1000, n)),
+            "float_qc_results": ("time", rng.random(n)),
+            "temperature": ("time", 10 + rng.random(n)),
+            "pressure": (
+                "time",
+                rng.random(n) * 100,
+                {"data_product_identifier": "RD-SENSOR_L1"},
+            ),
+            "salinity": ("time", rng.random(n)),
+        },
+        coords={"time": ("time", np.arange(n, dtype="float64"))},
+    )
+
+
+def test_policy_encodings(precision_ds):
+    _, enc = chunk_ds(precision_ds, apply=False, precision_policy=POLICY)
+    assert enc["temp_qc_results"]["dtype"] == np.uint8
+    # values or type that don't fit the policy keep their dtype
+    assert enc["wide_qc_results"]["dtype"] == np.int64
+    assert enc["float_qc_results"]["dtype"] == np.float64
+    assert enc["temperature"]["filters"] == [BitRound(7)]
+    # matched by data product identifier
+    assert enc["pressure"]["dtype"] == np.float32
+    assert enc["salinity"]["dtype"] == np.float64
+    assert not enc["salinity"].get("filters")
+
+
+def test_verify_reports_errors(precision_ds):
+    _, enc = chunk_ds(precision_ds, apply=False)
+    errors = apply_precision_policy(precision_ds, enc, POLICY, verify=True)
+    assert errors["temp_qc_results"] == 0
+    # 7 mantissa bits of values in [10, 11) are steps of 1/16
+    assert 0 < errors["temperature"] <= 2**-5
+    assert 0 < errors["pressure"] < 1e-4
+    assert set(errors) == {"temp_qc_results", "temperature", "pressure"}
+
+
+def test_policy_applies_on_write(store, precision_ds):
+    mod_ds, enc = chunk_ds(precision_ds, precision_policy=POLICY)
+    mod_ds.to_zarr(store, mode="w", encoding=enc)
+    ds = xr.open_zarr(store)
+    assert ds.temp_qc_results.encoding["dtype"] == np.uint8
+    np.testing.assert_array_equal(ds.temp_qc_results.values, precision_ds.temp_qc_results)
+    np.testing.assert_allclose(ds.temperature.values, precision_ds.temperature, atol=2**-5)
+    np.testing.assert_array_equal(ds.salinity.values, precision_ds.salinity)
+
+
+def test_out_of_range_append_is_refused(store, precision_ds):
+    from data_vent.exceptions import DtypeOverflowError
+    from data_vent.processor import ZarrStoreState, append_to_zarr
+
+    ds = precision_ds[["temp_qc_results"]]
+    mod_ds, enc = chunk_ds(ds.isel(time=slice(0, 500)), precision_policy=POLICY)
+    mod_ds.to_zarr(store, mode="w", encoding=enc)
+
+    later = ds.isel(time=slice(500, None)).copy(deep=True)
+    later["temp_qc_results"][10] = 300
+    mod_ds, enc = chunk_ds(later, apply=False)
+    with pytest.raises(DtypeOverflowError, match="temp_qc_results"):
+        append_to_zarr(mod_ds, store, enc, False, state=ZarrStoreState(store))
+    assert xr.open_zarr(store).sizes["time"] == 500
+
+    later["temp_qc_results"][10] = 255
+    mod_ds, enc = chunk_ds(later, apply=False)
+    append_to_zarr(mod_ds, store, enc, False, state=ZarrStoreState(store))
+    stored = xr.open_zarr(store).temp_qc_results
+    assert stored.encoding["dtype"] == np.uint8
+    assert stored.values[510] == 255
+
+
+def test_downcast_checks_every_value():
+    # the last value is past the leading 8MB sample
+    values = np.zeros(1_100_000, dtype="int64")
+    values[-1] = 300
+    ds = xr.Dataset(
+        {"temp_qc_results": ("time", values)},
+        coords={"time": ("time", np.arange(values.size, dtype="float64"))},
+    )
+    _, enc = chunk_ds(ds, apply=False, precision_policy=POLICY)
+    assert enc["temp_qc_results"]["dtype"] == np.int64
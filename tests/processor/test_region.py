@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import xarray as xr
+import zarr
+
+from data_vent.processor import ZarrStoreState, _commit_zarr, chunk_ds
+from data_vent.processor.region import _resize_time, write_region
+
+
+@pytest.fixture
+def presized_store(store, make_ds, create_store):
+    """Store holding samples 0 to 25 of 60, as pre-sized for a refresh"""
+    create_store(make_ds(0, 25), store)
+    _resize_time(store, 60)
+    _commit_zarr(store)
+    return store
+
+
+def _write(ds, store, region, state=None):
+    mod_ds, enc = chunk_ds(ds, apply=False)
+    return write_region(mod_ds, store, enc, region, False, state=state)
+
+
+def test_regions_in_any_order(presized_store, make_ds):
+    state = ZarrStoreState(presized_store)
+    _write(make_ds(45, 60), presized_store, (45, 60), state=state)
+    _write(make_ds(25, 45), presized_store, (25, 45), state=state)
+
+    ds = xr.open_zarr(presized_store, decode_times=False)
+    np.testing.assert_array_equal(ds.time.values, np.arange(60))
+    np.testing.assert_array_equal(ds.a.values, np.arange(60))
+    np.testing.assert_array_equal(ds.b.values[:, 1], np.arange(60))
+
+
+def test_length_mismatch_raises(presized_store, make_ds):
+    before = zarr.open_consolidated(presized_store)["time"][:]
+    with pytest.raises(ValueError, match="20 samples for a region of 15"):
+        _write(make_ds(25, 45), presized_store, (25, 40))
+    np.testing.assert_array_equal(zarr.open_consolidated(presized_store)["time"][:], before)
+
+
+def test_region_with_missing_and_new_variables(presized_store, make_ds):
+    state = ZarrStoreState(presized_store)
+    _write(make_ds(25, 45, variables=("a",)), presized_store, (25, 45), state=state)
+    _write(make_ds(45, 60, variables=("a", "b", "c")), presized_store, (45, 60), state=state)
+
+    ds = xr.open_zarr(presized_store, decode_times=False)
+    assert np.isnan(ds.b.values[25:45]).all()
+    np.testing.assert_array_equal(ds.b.values[45:, 0], np.arange(45, 60))
+    # created at the full length of the store
+    assert ds.c.shape == (60, 2)
+    assert np.isnan(ds.c.values[:45]).all()
+    np.testing.assert_array_equal(ds.c.values[45:, 0], np.arange(45, 60))
+
+
+def test_resize_cuts_unfilled_regions(presized_store, make_ds):
+    _write(make_ds(25, 45), presized_store, (25, 45))
+    # the file planned for 45:60 could not be written
+    _resize_time(presized_store, 45)
+    _commit_zarr(presized_store)
+
+    ds = xr.open_zarr(presized_store, decode_times=False)
+    assert ds.sizes["time"] == 45
+    assert ds.b.shape == (45, 2)
+    np.testing.assert_array_equal(ds.time.values, np.arange(45))
@@ -0,0 +1,54 @@
+import pytest
+import xarray as xr
+import zarr
+
+from data_vent.processor.replica import build_replica, update_replica
+from data_vent.utils.time_index import read_time_index
+
+
+@pytest.fixture
+def stores(store_factory, make_ds, create_store):
+    source = store_factory("stream.zarr")
+    create_store(make_ds(0, 95), source, chunk=10)
+    return source, store_factory("stream__analysis.zarr"), store_factory("temp.zarr")
+
+
+def _assert_replicates(source, replica):
+    xr.testing.assert_identical(
+        xr.open_zarr(replica, decode_times=False).load(),
+        xr.open_zarr(source, decode_times=False).load(),
+    )
+    assert read_time_index(replica)["end"] == zarr.open_consolidated(source)["time"][-1]
+
+
+def test_chunks_dont_depend_on_length(stores, make_ds, create_store):
+    source, replica, temp = stores
+    build_replica(source, replica, temp)
+    group = zarr.open_consolidated(replica)
+    # 50MB of float64 steps, one bin each
+    assert group["a"].chunks == (6_250_000,)
+    assert group["b"].chunks == (6_250_000, 1)
+    _assert_replicates(source, replica)
+
+    create_store(make_ds(0, 130), source, chunk=10)
+    update_replica(source, replica, temp)
+    _assert_replicates(source, replica)
+
+
+def test_build_extend_and_rebuild(stores, make_ds, create_store):
+    source, replica, temp = stores
+    update_replica(source, replica, temp, chunk_size="160B")
+    assert zarr.open_consolidated(replica)["b"].chunks == (20, 1)
+    _assert_replicates(source, replica)
+
+    # the source grew, the replica is extended in place
+    create_store(make_ds(0, 130), source, chunk=10)
+    stale = replica["b/0.0"]
+    update_replica(source, replica, temp, chunk_size="160B")
+    assert replica["b/0.0"] == stale
+    _assert_replicates(source, replica)
+
+    # the source no longer starts where the replica does, it's rebuilt
+    create_store(make_ds(5, 140), source, chunk=10)
+    update_replica(source, replica, temp, chunk_size="160B")
+    _assert_replicates(source, replica)
@@ -0,0 +1,50 @@
+import asyncio
+
+import fsspec
+import pytest
+from fsspec.implementations.asyn_wrapper import AsyncFileSystemWrapper
+
+from data_vent.processor import utils
+from data_vent.processor.utils import _clear_store, _delete_keys, _store_keys
+
+
+@pytest.fixture
+def async_store(tmp_path, make_ds, create_store):
+    """Committed store behind an async filesystem, the way s3fs is used"""
+    create_store(make_ds(0, 95), fsspec.get_mapper(str(tmp_path / "stream.zarr")), chunk=10)
+    fs = AsyncFileSystemWrapper(fsspec.filesystem("file"))
+    return fs.get_mapper(str(tmp_path / "stream.zarr"))
+
+
+def test_keys_listed_by_prefix(async_store, tmp_path):
+    keys = _store_keys(async_store, concurrency=2)
+    assert keys == set(fsspec.get_mapper(str(tmp_path / "stream.zarr")))
+    assert {".zmetadata", ".zgroup", "time/.zarray", "b/9.0"} <= keys
+    assert _store_keys(async_store.fs.get_mapper(str(tmp_path / "missing.zarr"))) == set()
+
+
+def test_deletes_are_batched_and_bounded(async_store, monkeypatch):
+    in_flight, calls = [0, 0], []
+    rm = async_store.fs._rm
+
+    async def tracked_rm(paths, **kwargs):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        calls.append(len(paths))
+        await asyncio.sleep(0.01)
+        await rm(paths, **kwargs)
+        in_flight[0] -= 1
+
+    monkeypatch.setattr(async_store.fs, "_rm", tracked_rm)
+    monkeypatch.setattr(utils, "DELETE_BATCH", 4)
+    keys = {k for k in _store_keys(async_store) if k.startswith(("a/", "b/"))}
+    _delete_keys(async_store, keys, concurrency=2)
+
+    assert sum(calls) == len(keys) and max(calls) == 4
+    assert in_flight[1] == 2
+    assert not keys & _store_keys(async_store)
+
+
+def test_clear_store(async_store):
+    _clear_store(async_store, concurrency=3)
+    assert _store_keys(async_store) == set()
@@ -0,0 +1,109 @@
+import fsspec
+import numpy as np
+import pytest
+import xarray as xr
+import zarr
+
+from data_vent.processor import ZarrStoreState, append_to_zarr, chunk_ds, is_zarr_ready
+from data_vent.processor.tail import (
+    _staged_tail,
+    _tail_zarr,
+    _write_tail,
+    compact_tail_store,
+    init_tail_store,
+    open_tail_dataset,
+    recover_tail_store,
+)
+from data_vent.utils.time_index import build_time_index, read_time_index
+
+
+@pytest.fixture
+def final_zarr(tmp_path, make_ds, create_store):
+    """Store of 95 samples in time chunks of 10, split into main and tail"""
+    path = str(tmp_path / "stream.zarr")
+    create_store(make_ds(0, 95), fsspec.get_mapper(path), chunk=10)
+    return path
+
+
+@pytest.fixture
+def stores(final_zarr):
+    return fsspec.get_mapper(final_zarr), fsspec.get_mapper(_tail_zarr(final_zarr))
+
+
+def _tail_append(ds, tail_store):
+    mod_ds, enc = chunk_ds(ds, apply=False)
+    append_to_zarr(mod_ds, tail_store, enc, False, state=ZarrStoreState(tail_store))
+
+
+def _times(final_zarr):
+    return open_tail_dataset(final_zarr, decode_times=False).time.values
+
+
+def test_init_splits_whole_spans(final_zarr, stores):
+    final_store, tail_store = stores
+    assert init_tail_store(final_store, tail_store, max_chunk="160B")
+
+    assert zarr.open_consolidated(final_store)["b"].shape == (90, 2)
+    assert zarr.open_consolidated(tail_store)["b"].shape == (5, 2)
+    # both indexes are published, the main one cut along with the store
+    assert read_time_index(final_store) == build_time_index(np.arange(90.0), 10)
+    assert read_time_index(tail_store)["end"] == 94.0
+    np.testing.assert_array_equal(_times(final_zarr), np.arange(95))
+
+
+def test_init_leaves_short_stores(tmp_path, make_ds, create_store):
+    final_store = fsspec.get_mapper(str(tmp_path / "short.zarr"))
+    tail_store = fsspec.get_mapper(str(tmp_path / "short__tail.zarr"))
+    create_store(make_ds(0, 8), final_store, chunk=10)
+    assert not init_tail_store(final_store, tail_store)
+    assert not is_zarr_ready(tail_store)
+
+
+def test_append_and_compact(final_zarr, stores, make_ds):
+    final_store, tail_store = stores
+    init_tail_store(final_store, tail_store, max_chunk="160B")
+    for start in (95, 105, 115):
+        _tail_append(make_ds(start, start + 10), tail_store)
+    np.testing.assert_array_equal(_times(final_zarr), np.arange(125))
+
+    assert compact_tail_store(final_store, tail_store, tail_max_chunk="160B") == 30
+    assert zarr.open_consolidated(final_store)["time"].shape == (120,)
+    tail = zarr.open_consolidated(tail_store)
+    assert tail["time"].shape == (5,)
+    # the rewritten tail keeps a time index
+    index = read_time_index(tail_store)
+    assert index == build_time_index(np.arange(120.0, 125.0), tail["time"].chunks[0])
+    assert not is_zarr_ready(_staged_tail(tail_store))
+
+    ds = open_tail_dataset(final_zarr, decode_times=False)
+    np.testing.assert_array_equal(ds.time.values, np.arange(125))
+    np.testing.assert_array_equal(ds.b.values[:, 1], np.arange(125))
+
+
+def test_full_compaction_removes_tail(final_zarr, stores, make_ds):
+    final_store, tail_store = stores
+    init_tail_store(final_store, tail_store, max_chunk="160B")
+    _tail_append(make_ds(95, 100), tail_store)
+
+    assert compact_tail_store(final_store, tail_store, full=True) == 10
+    assert not is_zarr_ready(tail_store)
+    np.testing.assert_array_equal(_times(final_zarr), np.arange(100))
+
+
+def test_interrupted_swap_is_recovered(final_zarr, stores, make_ds):
+    final_store, tail_store = stores
+    init_tail_store(final_store, tail_store, max_chunk="160B")
+    _tail_append(make_ds(95, 125), tail_store)
+    # the compaction moved 30 samples into the main store
+    ds = xr.open_zarr(tail_store, decode_times=False)
+    mod_ds, enc = chunk_ds(ds.isel(time=slice(0, 30)), apply=False)
+    append_to_zarr(mod_ds, final_store, enc, False, state=ZarrStoreState(final_store))
+    # died after staging the remainder and taking the old tail down
+    _write_tail(ds.isel(time=slice(30, None)), _staged_tail(tail_store), max_chunk="160B")
+    tail_store.pop(".zmetadata")
+
+    # readers see the main store alone meanwhile
+    np.testing.assert_array_equal(_times(final_zarr), np.arange(120))
+    recover_tail_store(tail_store)
+    assert not is_zarr_ready(_staged_tail(tail_store))
+    np.testing.assert_array_equal(_times(final_zarr), np.arange(125))